@@ -142,7 +142,7 @@ install_webserver() {
     ErrorLog ${APACHE_LOG_DIR}/${SITE_NAME}_error.log
     CustomLog ${APACHE_LOG_DIR}/${SITE_NAME}_access.log combined
 
-    WSGIDaemonProcess $NAME user=www-data group=www-data maximum-requests=10000 python-path=/home/$LOCAL_USER/env/lib/python2.6/site-packages
+    WSGIDaemonProcess $NAME user=www-data group=www-data maximum-requests=10000 threads=64 python-path=/home/$LOCAL_USER/env/lib/python2.6/site-packages
     WSGIProcessGroup $NAME
 
     WSGIScriptAlias / $PROJECT_ROOT/deploy/app.wsgi
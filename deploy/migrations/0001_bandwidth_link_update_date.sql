@@ -0,0 +1,5 @@
+-- Add the covering (link, update_date) index to an existing gmap_bandwidth.
+-- New databases get it from gmap/sql/bandwidth.sql on syncdb.
+--     ./manage.py dbshell < deploy/migrations/0001_bandwidth_link_update_date.sql
+CREATE INDEX gmap_bandwidth_link_update_date 
+    ON gmap_bandwidth (link, update_date, time, rx, tx);
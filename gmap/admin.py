@@ -1,7 +1,7 @@
 # Copyright (c) 2012 Shakir James and Washington University in St. Louis.
 # See LICENSE for details.
 
-from gmap.models import Bandwidth
+from gmap.models import Bandwidth, BandwidthRollup
 from django.contrib import admin
 
 class BandwidthAdmin(admin.ModelAdmin,):
@@ -11,4 +11,10 @@ class BandwidthAdmin(admin.ModelAdmin,):
     search_fields = ('link', 'rx', 'tx')
 
 
-admin.site.register(Bandwidth, BandwidthAdmin)
\ No newline at end of file
+class BandwidthRollupAdmin(admin.ModelAdmin,):
+    list_display = ('link', 'resolution', 'start', 'rx_avg', 'tx_avg')
+    list_filter = ('link', 'resolution')
+
+
+admin.site.register(Bandwidth, BandwidthAdmin)
+admin.site.register(BandwidthRollup, BandwidthRollupAdmin)
\ No newline at end of file
@@ -0,0 +1,56 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Sparkline images of rate series.
+
+Sparklines are drawn as SVG polylines, or as PNG images if PIL is installed,
+so clients do not need the Google visualization library to show them.
+"""
+from cStringIO import StringIO
+
+try:
+    from PIL import Image, ImageDraw
+except ImportError:
+    try:
+        import Image, ImageDraw
+    except ImportError:
+        Image = ImageDraw = None
+
+# size of the charts (px)
+WIDTH = 190
+HEIGHT = 63
+COLOR = '#4592B7'
+PNG = Image is not None
+
+
+def _points(values, width, height, pad=2):
+    """Return (x, y) pixel coordinates of values scaled to the chart."""
+    if not values:
+        return []
+    lo, hi = min(values), max(values)
+    span = float(hi - lo) or 1.0
+    step = float(width - 1) / max(len(values) - 1, 1)
+    scale = (height - 1 - 2 * pad) / span
+    return [(i * step, height - 1 - pad - (v - lo) * scale)
+        for i, v in enumerate(values)]
+
+
+def svg(values, width=WIDTH, height=HEIGHT, color=COLOR):
+    """Return an SVG document with a sparkline of values."""
+    points = ' '.join(['{0:.1f},{1:.1f}'.format(x, y)
+        for x, y in _points(values, width, height)])
+    return ('<svg xmlns="http://www.w3.org/2000/svg" width="{0}" '
+        'height="{1}" viewBox="0 0 {0} {1}"><polyline fill="none" '
+        'stroke="{2}" stroke-width="1.5" points="{3}"/></svg>').format(
+        width, height, color, points)
+
+
+def png(values, width=WIDTH, height=HEIGHT, color=COLOR):
+    """Return a PNG image with a sparkline of values (requires PIL)."""
+    image = Image.new('RGB', (width, height), 'white')
+    points = _points(values, width, height)
+    if len(points) > 1:
+        ImageDraw.Draw(image).line(points, fill=color)
+    buf = StringIO()
+    image.save(buf, 'PNG')
+    return buf.getvalue()
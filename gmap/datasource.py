@@ -0,0 +1,280 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Google Visualization data source over the bandwidth history.
+
+Queries (the tq parameter) use a subset of the query language:
+
+    [select <item>, ...] [where <condition> and ...]
+    [group by bucket(time, <seconds>)] [limit <n>] [offset <n>]
+
+Columns are link, time, rx, tx and update_date. A select item is a column,
+avg/min/max/sum/count(<column>), or bucket(time, <seconds>): the start of the
+time bucket of a report (sum and avg need a number column). A condition
+compares a column with a number (or a datetime 'yyyy-MM-dd HH:mm:ss' literal
+for update_date) by =, !=, <>, <, <=, > or >=. Conditions, grouping,
+aggregates and limits are all run in SQL.
+"""
+import re
+from datetime import datetime
+from django.conf import settings
+from django.db import connection
+from django.db.models import Avg, Count, Max, Min, Sum
+from gmap.models import Bandwidth
+from gmap.utils import gviz_api
+
+# queries return at most MAX_ROWS rows
+MAX_ROWS = getattr(settings, 'GMAP_DATASOURCE_MAX_ROWS', 10000)
+
+COLUMNS = {
+    'link': 'number',
+    'time': 'number',
+    'rx': 'number',
+    'tx': 'number',
+    'update_date': 'datetime',
+}
+AGGREGATES = {
+    'avg': Avg,
+    'min': Min,
+    'max': Max,
+    'sum': Sum,
+    'count': Count,
+}
+OPERATORS = {
+    '=': 'exact',
+    '<': 'lt',
+    '<=': 'lte',
+    '>': 'gt',
+    '>=': 'gte',
+}
+# floor(time / seconds) * seconds, per database vendor
+BUCKET_SQL = {
+    'postgresql': 'FLOOR({0} / %s) * %s',
+    'mysql': 'FLOOR({0} / %s) * %s',
+    # times are positive, so truncation is floor
+    'sqlite': 'CAST({0} / %s AS INTEGER) * %s',
+}
+
+_TOKEN = re.compile(r"""\s*(?:
+    (?P<number>-?\d+(?:\.\d*)?) |
+    (?P<string>'[^']*'|"[^"]*") |
+    (?P<name>[A-Za-z_]\w*) |
+    (?P<op><=|>=|!=|<>|[=<>(),]))""", re.VERBOSE)
+
+
+class QueryError(ValueError):
+    """The query is not valid or not supported."""
+    pass
+
+
+def _tokens(query):
+    """Return a list of (kind, value) tokens of a query."""
+    tokens, pos, query = [], 0, query.strip()
+    while pos < len(query):
+        m = _TOKEN.match(query, pos)
+        if m is None:
+            raise QueryError('unexpected input at {0!r}'.format(query[pos:]))
+        kind = m.lastgroup
+        value = m.group(kind)
+        if kind == 'number':
+            value = float(value) if '.' in value else int(value)
+        elif kind == 'string':
+            value = value[1:-1]
+        elif kind == 'name':
+            value = value.lower()
+        tokens.append((kind, value))
+        pos = m.end()
+    return tokens
+
+
+class Query(object):
+    """A parsed data source query"""
+
+    def __init__(self, query=''):
+        """
+        Args:
+            query: query string (see the module documentation)
+        Raises:
+            QueryError: if the query is not valid or not supported
+        """
+        self.select = None # (kind, argument) items
+        self.filters = [] # (column, lookup, value, negate)
+        self.bucket = None # seconds
+        self.limit = MAX_ROWS
+        self.offset = 0
+        self._tokens = _tokens(query)
+        self._parse()
+
+    def _next(self, kind=None, value=None):
+        if not self._tokens:
+            raise QueryError('unexpected end of query')
+        token = self._tokens.pop(0)
+        if (kind and token[0] != kind) or (value and token[1] != value):
+            raise QueryError('expected {0}, got {1!r}'.format(value or kind,
+                token[1]))
+        return token[1]
+
+    def _peek(self, value):
+        return bool(self._tokens) and self._tokens[0][1] == value
+
+    def _column(self):
+        name = self._next('name')
+        if name not in COLUMNS:
+            raise QueryError('unknown column {0!r}'.format(name))
+        return name
+
+    def _bucket(self):
+        """Parse (time, <seconds>) after bucket."""
+        self._next('op', '(')
+        self._next('name', 'time')
+        self._next('op', ',')
+        seconds = self._next('number')
+        self._next('op', ')')
+        if seconds <= 0:
+            raise QueryError('bucket seconds must be positive')
+        return seconds
+
+    def _item(self):
+        name = self._next('name')
+        if name == 'bucket':
+            return ('bucket', self._bucket())
+        if name in AGGREGATES and self._peek('('):
+            self._next('op', '(')
+            column = self._column()
+            self._next('op', ')')
+            return (name, column)
+        if name not in COLUMNS:
+            raise QueryError('unknown column {0!r}'.format(name))
+        return ('column', name)
+
+    def _condition(self):
+        column = self._column()
+        op = self._next('op')
+        if op not in OPERATORS and op not in ('!=', '<>'):
+            raise QueryError('unsupported operator {0!r}'.format(op))
+        if COLUMNS[column] == 'datetime':
+            self._next('name', 'datetime')
+            try:
+                value = datetime.strptime(self._next('string'),
+                    '%Y-%m-%d %H:%M:%S')
+            except ValueError:
+                raise QueryError('expected datetime \'yyyy-MM-dd HH:mm:ss\'')
+        else:
+            value = self._next('number')
+        if op in ('!=', '<>'):
+            self.filters.append((column, 'exact', value, True))
+        else:
+            self.filters.append((column, OPERATORS[op], value, False))
+
+    def _parse(self):
+        if self._peek('select'):
+            self._next()
+            self.select = [self._item()]
+            while self._peek(','):
+                self._next()
+                self.select.append(self._item())
+        if self._peek('where'):
+            self._next()
+            self._condition()
+            while self._peek('and'):
+                self._next()
+                self._condition()
+        if self._peek('group'):
+            self._next()
+            self._next('name', 'by')
+            self._next('name', 'bucket')
+            self.bucket = self._bucket()
+        for clause in ('limit', 'offset'):
+            if self._peek(clause):
+                self._next()
+                n = self._next('number')
+                if not isinstance(n, int) or n < 0:
+                    raise QueryError('{0} must be a whole number'.format(
+                        clause))
+                if clause == 'limit':
+                    n = min(n, MAX_ROWS)
+                setattr(self, clause, n)
+        if self._tokens:
+            raise QueryError('unexpected {0!r}'.format(self._tokens[0][1]))
+        if self.select is None:
+            if self.bucket is None:
+                self.select = [('column', c) 
+                    for c in ('link', 'update_date', 'time', 'rx', 'tx')]
+            else:
+                self.select = [('bucket', self.bucket), ('avg', 'rx'), 
+                    ('avg', 'tx')]
+        self._check()
+
+    def _check(self):
+        aggregates = [i for i in self.select if i[0] in AGGREGATES]
+        for kind, arg in self.select:
+            if kind == 'bucket' and arg != self.bucket:
+                raise QueryError('bucket(time, {0}) is not grouped'.format(
+                    arg))
+            if kind == 'column' and (aggregates or self.bucket):
+                raise QueryError('{0!r} is not grouped or aggregated'.format(
+                    arg))
+            if kind in ('avg', 'sum') and COLUMNS[arg] != 'number':
+                raise QueryError('{0}({1}) needs a number column'.format(kind, 
+                    arg))
+
+    def description(self):
+        """Return a DataTable description of the selected columns."""
+        description = []
+        for kind, arg in self.select:
+            if kind == 'column':
+                description.append((arg, COLUMNS[arg]))
+            elif kind == 'bucket':
+                description.append(('bucket', 'number', 'bucket(time)'))
+            else:
+                # min and max have the type of their column
+                column_type = (kind in ('min', 'max') and COLUMNS[arg] or 
+                    'number')
+                description.append(('{0}-{1}'.format(kind, arg), column_type,
+                    '{0} {1}'.format(kind, arg)))
+        return description
+
+    def _queryset(self):
+        qs = Bandwidth.objects.all()
+        for column, lookup, value, negate in self.filters:
+            kwargs = {'{0}__{1}'.format(column, lookup): value}
+            qs = negate and qs.exclude(**kwargs) or qs.filter(**kwargs)
+        return qs
+
+    def _name(self, kind, arg):
+        """Return the name of a select item in query results."""
+        if kind == 'column':
+            return arg
+        if kind == 'bucket':
+            return 'bucket'
+        return '{0}_{1}'.format(kind, arg)
+
+    def rows(self):
+        """Return a list of rows (lists of the selected values)."""
+        qs = self._queryset()
+        aggregates = dict([(self._name(kind, arg), AGGREGATES[kind](arg))
+            for kind, arg in self.select if kind in AGGREGATES])
+        names = [self._name(kind, arg) for kind, arg in self.select]
+        if self.bucket is not None:
+            column = '{0}.{1}'.format(
+                connection.ops.quote_name(Bandwidth._meta.db_table),
+                connection.ops.quote_name('time'))
+            sql = BUCKET_SQL.get(connection.vendor, BUCKET_SQL['postgresql'])
+            qs = (qs.extra(select={'bucket': sql.format(column)},
+                    select_params=(self.bucket, self.bucket))
+                .values('bucket').annotate(**aggregates).order_by('bucket'))
+            rows = qs[self.offset:self.offset + self.limit]
+            return [[row[name] for name in names] for row in rows]
+        if aggregates:
+            if self.offset:
+                return []
+            row = qs.aggregate(**aggregates)
+            return [[row[name] for name in names]]
+        qs = qs.order_by('update_date', 'id').values_list(*names)
+        return [list(row) for row in qs[self.offset:self.offset + self.limit]]
+
+    def table(self):
+        """Return a DataTable of the query result."""
+        data_table = gviz_api.DataTable(self.description(), columnar=True)
+        data_table.LoadData(self.rows())
+        return data_table
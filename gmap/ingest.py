@@ -0,0 +1,156 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Write-behind buffer for bandwidth reports.
+
+With GMAP_WRITE_BEHIND set, the bw views acknowledge reports immediately and
+a background thread stores them with Bandwidth.objects.add_reports every
+GMAP_WRITE_BEHIND_FLUSH_INTERVAL ms or GMAP_WRITE_BEHIND_FLUSH_SIZE reports.
+"""
+import atexit
+import logging
+import threading
+import time
+from Queue import Queue, Empty
+from django.conf import settings
+from django.db import connection
+from gmap.models import Bandwidth
+
+WRITE_BEHIND = getattr(settings, 'GMAP_WRITE_BEHIND', False)
+# reports are dropped when the buffer holds MAX_SIZE reports
+WRITE_BEHIND_MAX_SIZE = getattr(settings, 'GMAP_WRITE_BEHIND_MAX_SIZE', 10000)
+WRITE_BEHIND_FLUSH_INTERVAL = getattr(settings,
+    'GMAP_WRITE_BEHIND_FLUSH_INTERVAL', 500) # ms
+WRITE_BEHIND_FLUSH_SIZE = getattr(settings, 'GMAP_WRITE_BEHIND_FLUSH_SIZE', 500)
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer(object):
+    """Bounded queue of (link, time, rx, tx) reports flushed in bulk"""
+
+    def __init__(self, max_size=WRITE_BEHIND_MAX_SIZE,
+            flush_interval=WRITE_BEHIND_FLUSH_INTERVAL,
+            flush_size=WRITE_BEHIND_FLUSH_SIZE, autostart=True):
+        """
+        Args:
+            max_size: maximum number of buffered reports
+            flush_interval: flush at least every flush_interval ms
+            flush_size: flush when flush_size reports are buffered
+            autostart: start the flush thread on the first put
+        """
+        self.queue = Queue(max_size)
+        self.flush_interval = flush_interval / 1000.0
+        self.flush_size = flush_size
+        self.autostart = autostart
+        self.dropped = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.flush_latency = 0.0 # seconds, total over all flushes
+        self.last_flush_latency = 0.0
+        self._lock = threading.Lock()
+        # serializes puts: only the flush thread frees space meanwhile
+        self._put_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the flush thread (if not running)."""
+        with self._lock:
+            if self._thread is None or not self._thread.isAlive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run,
+                    name='gmap-write-behind')
+                self._thread.setDaemon(True)
+                self._thread.start()
+
+    def stop(self, timeout=10):
+        """Stop the flush thread and store all buffered reports."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self.flush()
+
+    def put(self, report):
+        """Buffer a report. Return False if the report was dropped."""
+        return self.put_many([report]) == 1
+
+    def put_many(self, reports):
+        """Buffer all reports, or none if they do not all fit. Return the 
+        number of reports accepted."""
+        if self.autostart:
+            self.start()
+        reports = list(reports)
+        with self._put_lock:
+            free = self.queue.maxsize - self.queue.qsize()
+            if self.queue.maxsize > 0 and free < len(reports):
+                with self._lock:
+                    self.dropped += len(reports)
+                return 0
+            for report in reports:
+                self.queue.put_nowait(report)
+        return len(reports)
+
+    def _get_batch(self, timeout):
+        """Return up to flush_size reports collected within timeout."""
+        batch = []
+        deadline = time.time() + timeout
+        while len(batch) < self.flush_size:
+            remaining = deadline - time.time()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(True, remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except Empty:
+                break
+        return batch
+
+    def _store(self, batch):
+        """Store a batch of reports and update the counters."""
+        t0 = time.time()
+        try:
+            Bandwidth.objects.add_reports(batch)
+        except Exception:
+            logger.exception('dropped %d bandwidth reports', len(batch))
+            connection.close() # reconnect on the next flush
+            with self._lock:
+                self.dropped += len(batch)
+            return
+        latency = time.time() - t0
+        with self._lock:
+            self.flushed += len(batch)
+            self.flushes += 1
+            self.flush_latency += latency
+            self.last_flush_latency = latency
+
+    def flush(self):
+        """Store all buffered reports now."""
+        batch = self._get_batch(0)
+        while batch:
+            self._store(batch)
+            batch = self._get_batch(0)
+
+    def _run(self):
+        while not self._stop.isSet():
+            batch = self._get_batch(self.flush_interval)
+            if batch:
+                self._store(batch)
+
+    def stats(self):
+        """Return a dictionary of buffer counters."""
+        with self._lock:
+            avg = self.flushes and self.flush_latency / self.flushes or 0.0
+            return {
+                'queue_depth': self.queue.qsize(),
+                'dropped': self.dropped,
+                'flushed': self.flushed,
+                'flushes': self.flushes,
+                'last_flush_latency': self.last_flush_latency,
+                'avg_flush_latency': avg,
+            }
+
+
+write_behind = WriteBehindBuffer()
+# store buffered reports when the worker process exits
+atexit.register(write_behind.stop)
@@ -0,0 +1,133 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Stores of the two most recent traffic samples per link.
+
+The ingest path (Bandwidth.save and BandwidthManager.add_reports) pushes new
+samples into the store, so BandwidthManager.rate can compute a link's rate
+without a query. A link missing from the store is read from the database
+once. GMAP_LATEST_STORE selects the backend:
+    'locmem': a dictionary in each process (default); other processes do not
+        push their reports into it, so entries expire after
+        GMAP_LATEST_LOCMEM_TIMEOUT seconds
+    'cache': the Django cache, shared by processes
+    None: no store, always query the database
+"""
+import threading
+import time
+from collections import namedtuple
+from django.conf import settings
+from django.core.cache import cache
+
+LATEST_STORE = getattr(settings, 'GMAP_LATEST_STORE', 'locmem')
+# expire cached samples of links that stop reporting
+LATEST_STORE_TIMEOUT = getattr(settings, 'GMAP_LATEST_STORE_TIMEOUT', 3600)
+# re-read locmem samples after LATEST_LOCMEM_TIMEOUT seconds (the link alive
+# interval by default), they miss the reports of other processes
+LATEST_LOCMEM_TIMEOUT = getattr(settings, 'GMAP_LATEST_LOCMEM_TIMEOUT',
+    getattr(settings, 'GMAP_LINK_ALIVE_INTERVAL', 5))
+
+# a traffic sample: the fields of Bandwidth used to calculate rates
+Sample = namedtuple('Sample', 'time rx tx')
+
+
+class DummyStore(object):
+    """Store that keeps nothing"""
+
+    def get(self, link):
+        """Return a tuple of the latest samples (newest first) or None."""
+        return None
+
+    def set(self, link, samples):
+        """Set the latest samples (newest first) of a link."""
+        pass
+
+    def push(self, link, sample):
+        """Add a new sample to a link already in the store."""
+        pass
+
+    def delete(self, link):
+        pass
+
+    def clear(self):
+        pass
+
+
+class LocMemStore(DummyStore):
+    """Store in a process-local dictionary, entries expire after timeout s"""
+
+    def __init__(self, timeout=LATEST_LOCMEM_TIMEOUT):
+        self.timeout = timeout
+        self._samples = {} # link: (expiry time, samples)
+        self._lock = threading.Lock()
+
+    def get(self, link):
+        entry = self._samples.get(int(link))
+        if entry is None or entry[0] <= time.time():
+            return None
+        return entry[1]
+
+    def set(self, link, samples):
+        self._samples[int(link)] = (time.time() + self.timeout, 
+            tuple(samples[:2]))
+
+    def push(self, link, sample):
+        link = int(link)
+        with self._lock:
+            entry = self._samples.get(link)
+            if entry is not None and entry[0] > time.time():
+                # pushes do not extend the entry: other processes may have
+                # stored newer reports
+                self._samples[link] = (entry[0], (sample, ) + entry[1][:1])
+
+    def delete(self, link):
+        self._samples.pop(int(link), None)
+
+    def clear(self):
+        self._samples.clear()
+
+
+class CacheStore(DummyStore):
+    """Store in the Django cache"""
+    prefix = 'gmap.latest'
+
+    def _key(self, link):
+        # the generation number changes on clear
+        gen = cache.get(self.prefix)
+        if gen is None:
+            gen = 0
+            cache.add(self.prefix, gen)
+        return '{0}.{1}.{2}'.format(self.prefix, gen, int(link))
+
+    def get(self, link):
+        samples = cache.get(self._key(link))
+        if samples is None:
+            return None
+        return tuple([Sample(*s) for s in samples])
+
+    def set(self, link, samples):
+        cache.set(self._key(link), tuple([tuple(s) for s in samples[:2]]),
+            LATEST_STORE_TIMEOUT)
+
+    def push(self, link, sample):
+        samples = self.get(link)
+        if samples is not None:
+            self.set(link, (sample, ) + samples[:1])
+
+    def delete(self, link):
+        cache.delete(self._key(link))
+
+    def clear(self):
+        try:
+            cache.incr(self.prefix)
+        except ValueError:
+            pass
+
+
+STORES = {
+    None: DummyStore,
+    'locmem': LocMemStore,
+    'cache': CacheStore,
+}
+
+store = STORES[LATEST_STORE]()
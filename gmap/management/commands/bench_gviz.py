@@ -0,0 +1,63 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Benchmark DataTable JSON encoding: rows vs. columns."""
+import random
+import sys
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from gmap.utils import gviz_api
+
+
+class Command(BaseCommand):
+    help = ('Time loading and encoding a sparkline-like DataTable with row '
+            'storage and with columnar storage.')
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=50000,
+            help='number of rows in the table'),
+        make_option('--repeat', type='int', default=3,
+            help='number of timed runs (best is reported)'),
+    )
+
+    def handle(self, *args, **options):
+        n, repeat = options['rows'], options['repeat']
+        description = [('time', 'number'), ('rx', 'number'), ('tx', 'number')]
+        time_col = [float(i) for i in xrange(n)]
+        rx_col = [round(random.random() * 1000, 1) for i in xrange(n)]
+        tx_col = [round(random.random() * 1000, 1) for i in xrange(n)]
+
+        def rows():
+            table = gviz_api.DataTable(description)
+            table.LoadData(zip(time_col, rx_col, tx_col))
+            return table
+
+        def columns():
+            table = gviz_api.DataTable(description, columnar=True)
+            table.AppendColumns({'time': time_col, 'rx': rx_col, 'tx': tx_col})
+            return table
+
+        assert rows().ToJSon() == columns().ToJSon()
+        self.stdout.write('{0:>10} {1:>10} {2:>12}\n'.format(
+            'storage', 'ms', 'stored KiB'))
+        for name, make in (('rows', rows), ('columns', columns)):
+            best = min([self._time(make) for i in xrange(repeat)])
+            kib = self._stored_size(make()) / 1024.0
+            self.stdout.write('{0:>10} {1:>10.1f} {2:>12.0f}\n'.format(
+                name, best * 1000.0, kib))
+
+    def _time(self, make):
+        t0 = time.time()
+        make().ToJSon()
+        return time.time() - t0
+
+    def _stored_size(self, table):
+        """Return the bytes of the containers holding the table data (the 
+        values are shared by both storages)."""
+        data = table._DataTable__data
+        size = sys.getsizeof(data)
+        for item in data:
+            size += sys.getsizeof(item)
+            if isinstance(item, tuple): # (row dictionary, custom properties)
+                size += sys.getsizeof(item[0])
+        return size
@@ -0,0 +1,54 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Benchmark per-link rate lookups as the bandwidth history grows."""
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from django.db import connection
+from gmap.models import Bandwidth
+
+
+class Command(BaseCommand):
+    help = ('Time the latest-samples query of BandwidthManager.rate on '
+            'histories of increasing size (in a test database).')
+    option_list = BaseCommand.option_list + (
+        make_option('--links', type='int', default=20,
+            help='number of links reporting'),
+        make_option('--rows', default='10000,100000,1000000',
+            help='comma-separated history sizes (total rows)'),
+        make_option('--lookups', type='int', default=1000,
+            help='number of timed lookups per history size'),
+    )
+
+    def handle(self, *args, **options):
+        links = options['links']
+        sizes = [int(n) for n in options['rows'].split(',')]
+        lookups = options['lookups']
+        verbosity = int(options.get('verbosity', 1))
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=verbosity)
+        try:
+            self.stdout.write('{0:>10} {1:>12}\n'.format('rows', 'ms/lookup'))
+            rows = 0
+            for size in sizes:
+                rows = self._fill(rows, size, links)
+                t0 = time.time()
+                for i in xrange(lookups):
+                    Bandwidth.objects._fetch_latest(i % links)
+                ms = (time.time() - t0) * 1000.0 / lookups
+                self.stdout.write('{0:>10} {1:>12.3f}\n'.format(rows, ms))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity)
+
+    def _fill(self, rows, size, links):
+        """Add reports from all links until the history has size rows."""
+        batch = []
+        for n in xrange(rows, size):
+            t = float(n // links)
+            batch.append((n % links, t, n + 1, n + 1))
+            if len(batch) == 10000:
+                Bandwidth.objects.add_reports(batch)
+                batch = []
+        Bandwidth.objects.add_reports(batch)
+        return max(rows, size)
@@ -0,0 +1,54 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Benchmark windowed rates: generator over samples vs. columns."""
+import random
+import time
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from gmap import rates
+from gmap.latest import Sample
+from gmap.models import Bandwidth, SLIDING_WINDOW_LEN
+
+
+class Command(BaseCommand):
+    help = ('Time rx and tx windowed rates over a synthetic history with '
+            'the sample generator and with the column path.')
+    option_list = BaseCommand.option_list + (
+        make_option('--rows', type='int', default=100000,
+            help='number of samples in the history'),
+        make_option('--repeat', type='int', default=3,
+            help='number of timed runs (best is reported)'),
+    )
+
+    def handle(self, *args, **options):
+        n, repeat = options['rows'], options['repeat']
+        rows, rx, tx = [], 0, 0
+        for i in xrange(n):
+            rx += random.randint(0, 10 ** 6)
+            tx += random.randint(0, 10 ** 6)
+            rows.append((float(i // 2), rx, tx)) # zero time deltas too
+        manager = Bandwidth.objects
+        w = SLIDING_WINDOW_LEN
+
+        def generator():
+            samples = [Sample(*row) for row in rows]
+            return ([manager._get_rate('rx', s[0], s[-1]) 
+                        for s in manager._window(iter(samples), w)],
+                    [manager._get_rate('tx', s[0], s[-1]) 
+                        for s in manager._window(iter(samples), w)])
+
+        def vectorized():
+            return rates.window_rates(*rates.columns(rows), window_len=w)
+
+        assert generator() == vectorized()
+        backend = rates.numpy is not None and 'numpy' or 'array'
+        for name, func in (('generator', generator), (backend, vectorized)):
+            best = min([self._time(func) for i in xrange(repeat)])
+            self.stdout.write('{0:>10}: {1:.1f} ms ({2} rows)\n'.format(
+                name, best * 1000.0, n))
+
+    def _time(self, func):
+        t0 = time.time()
+        func()
+        return time.time() - t0
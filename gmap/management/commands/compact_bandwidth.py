@@ -0,0 +1,29 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Roll up bandwidth reports and expire rolled-up raw reports."""
+from optparse import make_option
+from django.core.management.base import BaseCommand
+from gmap.models import Bandwidth, BandwidthRollup
+
+
+class Command(BaseCommand):
+    help = ('Roll up new bandwidth reports into GMAP_ROLLUP_RESOLUTIONS '
+            'buckets and delete raw reports older than GMAP_RAW_RETENTION.')
+    option_list = BaseCommand.option_list + (
+        make_option('--no-expire', action='store_false', dest='expire',
+            default=True, help='keep raw reports'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        links = (Bandwidth.objects.order_by('link')
+            .values_list('link', flat=True).distinct())
+        for link in links:
+            count = BandwidthRollup.objects.compact(link)
+            cutoff = None
+            if options['expire']:
+                cutoff = BandwidthRollup.objects.expire(link)
+            if verbosity > 1:
+                self.stdout.write('link {0}: {1} rollups, expired before '
+                    '{2}\n'.format(link, count, cutoff))
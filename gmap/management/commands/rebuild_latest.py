@@ -0,0 +1,20 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Fill the latest samples table from the bandwidth reports."""
+from django.core.management.base import BaseCommand
+from gmap.models import Bandwidth, LatestBandwidth
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the latest two samples of every link from its reports '
+            '(run once on databases created before gmap_latestbandwidth).')
+
+    def handle(self, *args, **options):
+        verbosity = int(options.get('verbosity', 1))
+        links = (Bandwidth.objects.order_by('link')
+            .values_list('link', flat=True).distinct())
+        for link in links:
+            LatestBandwidth.objects.rebuild(link)
+            if verbosity > 1:
+                self.stdout.write('link {0}: rebuilt\n'.format(link))
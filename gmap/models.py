@@ -1,15 +1,29 @@
 # Copyright (c) 2012 Shakir James and Washington University in St. Louis.
 # See LICENSE for details.
 
+import threading
 from datetime import datetime, timedelta
-from itertools import islice, tee, izip
+from time import mktime
+from itertools import groupby, islice, tee, izip
+from operator import itemgetter
 from django.conf import settings
-from django.db import models
+from django.db import IntegrityError, connection, models, transaction
+from django.db.models.signals import post_delete, pre_delete
+from gmap.latest import Sample, store
+from gmap.rates import columns, window_rates
 
 # output log if difference in traffic is less than than TRAFFIC_DELTA_MIN
 TRAFFIC_DELTA_MIN = 1000.0
 SLIDING_WINDOW_LEN = 4
 LINK_ALIVE_INTERVAL = getattr(settings, 'GMAP_LINK_ALIVE_INTERVAL', 5)
+# maximum number of rows in one multi-row INSERT (sqlite allows 999 params)
+BULK_INSERT_SIZE = getattr(settings, 'GMAP_BULK_INSERT_SIZE', 150)
+# bucket lengths (s) of the rate rollups
+ROLLUP_RESOLUTIONS = getattr(settings, 'GMAP_ROLLUP_RESOLUTIONS', 
+    (60, 300, 3600))
+# keep raw reports for RAW_RETENTION seconds after they are rolled up
+# (None keeps them forever)
+RAW_RETENTION = getattr(settings, 'GMAP_RAW_RETENTION', 86400)
 
 
 class BandwidthManager(models.Manager):
@@ -35,14 +49,49 @@ class BandwidthManager(models.Manager):
         rate = bits_delta / time_delta        
         return rate
     
+    def _pair_rate(self, x0, x1):
+        """Return a rate tuple (rx, tx) between two samples"""
+        rx, tx = self._get_rate('rx', x0, x1), self._get_rate('tx', x0, x1) 
+        # Test for negative rate:
+        #    Negative rates happen when the lastest report's (rx,tx) 
+        #    is less than the penultimate one: a counter rolls over.
+        if rx < 0: rx = 1
+        if tx < 0: tx = 1
+        return (rx, tx)
+    
+    def _samples(self, link):
+        """Return a queryset of (time, rx, tx) tuples for a link.
+        
+        The (link, update_date, time, rx, tx) index (see sql/bandwidth.sql)
+        answers these queries without reading the table.
+        """
+        return self.filter(link=link).values_list('time', 'rx', 'tx')
+
+    def _fetch_latest(self, link):
+        """Return the two most recent samples of a link from the database."""
+        return [Sample(*row) for row in 
+            self._samples(link).order_by('-update_date', '-id')[:2]]
+
+    def _latest(self, link):
+        """Return the two most recent samples of a link (newest first)."""
+        samples = store.get(link)
+        if samples is None:
+            samples = self._fetch_latest(link)
+            store.set(link, samples)
+        return samples
+
     def rate(self, link):
         """Return a rate tuple (rx, tx) for a link in Bps.
         Args:
             link: link id        
         """
+        return self._latest_rate(self._latest(link))
+
+    def _latest_rate(self, samples):
+        """Return a rate tuple (rx, tx) from the two most recent samples."""
         try:
             # Get the two most recent entries
-            t1,t0 = self.filter(link=link).order_by('-update_date')[:2]
+            t1,t0 = samples
         except (IndexError, ValueError) :
             return (0, 0)
         else:
@@ -50,27 +99,141 @@ class BandwidthManager(models.Manager):
             #if alive_int > timedelta(seconds=LINK_ALIVE_INTERVAL):
             #    # link is inactive
             #    return (0, 0)            
-            rx, tx = self._get_rate('rx', t0, t1), self._get_rate('tx', t0, t1) 
-            # Test for negative rate:
-            #    Negative rates happen when the lastest report's (rx,tx) 
-            #    is less than the penultimate one: a counter rolls over.
-            if rx < 0: rx = 1
-            if tx < 0: tx = 1
-            return (rx, tx)
+            return self._pair_rate(t0, t1)
     
-    def rates(self, direction, link, window_len=SLIDING_WINDOW_LEN):
+    def _recent(self, link, window_len, seconds=None, limit=None):
+        """Return a list of the link's samples (oldest first) for the last
+        limit rates in the last seconds seconds."""
+        qs = self._samples(link)
+        if seconds is not None:
+            since = datetime.now() - timedelta(seconds=seconds)
+            qs = qs.filter(update_date__gte=since)
+        if limit is not None:
+            # the newest samples, read backwards along the index
+            samples = list(qs.order_by('-update_date', '-id')
+                [:limit + window_len - 1])
+            samples.reverse()
+            return samples
+        return qs.order_by('update_date', 'id').iterator()
+
+    def window_rates(self, link, window_len=SLIDING_WINDOW_LEN, 
+            seconds=None, limit=None):
+        """Return lists of (rx, tx) average rates from one query
+        
+        Args:
+            link: link id
+            seconds: only use reports received in the last seconds seconds
+            limit: return at most limit (most recent) rates
+        """
+        qs = self._recent(link, window_len, seconds, limit)
+        return window_rates(*columns(qs), window_len=window_len)
+
+    def window_rates_many(self, links=None, window_len=SLIDING_WINDOW_LEN, 
+            seconds=None, limit=None, map=map):
+        """Return a dictionary of link id to lists of (rx, tx) average rates
+        from one query (links without reports are left out).
+
+        Args:
+            links: iterable of link ids, or None for all links
+            seconds: only use reports received in the last seconds seconds
+                (without it, the whole history of the links is read)
+            limit: return at most limit (most recent) rates per link
+            map: function that maps the rates computation over the links 
+                (e.g. the map of a thread pool)
+        """
+        qs = self.all()
+        if links is not None:
+            qs = qs.filter(link__in=[int(link) for link in links])
+        if seconds is not None:
+            since = datetime.now() - timedelta(seconds=seconds)
+            qs = qs.filter(update_date__gte=since)
+        rows = qs.order_by('link', 'update_date', 'id').values_list('link', 
+            'time', 'rx', 'tx')
+        groups = [(link, [row[1:] for row in group]) 
+            for link, group in groupby(rows, itemgetter(0))]
+        if limit is not None:
+            groups = [(link, samples[-(limit + window_len - 1):])
+                for link, samples in groups]
+        def link_rates(group):
+            link, samples = group
+            return (link, window_rates(*columns(samples), 
+                window_len=window_len))
+        return dict(map(link_rates, groups))
+
+    def rates(self, direction, link, window_len=SLIDING_WINDOW_LEN, 
+            seconds=None, limit=None):
         """Return a list of average rates
         
         Args:
             direction: 'rx' or 'tx' traffic
             link: link id
+            seconds: only use reports received in the last seconds seconds
+            limit: return at most limit (most recent) rates
+        """
+        rx, tx = self.window_rates(link, window_len, seconds, limit)
+        return rx if direction == 'rx' else tx
+
+    def last_seq(self, link=None):
+        """Return the sequence number of the newest report (of a link).
+        
+        Report ids are the ingest sequence numbers: they only increase.
+        """
+        qs = self if link is None else self.filter(link=link)
+        return qs.aggregate(seq=models.Max('id'))['seq'] or 0
+
+    def add_reports(self, reports):
+        """Store traffic reports with multi-row INSERT statements.
+
+        Reports with zero rx and tx bits are skipped (see Bandwidth.save).
+        Returns the number of reports stored.
+
+        Args:
+            reports: iterable of (link, time, rx, tx) tuples
         """
-        qs  = Bandwidth.objects.filter(link=link).order_by('update_date')
-        itr = qs.iterator()
-        rates = []
-        for swin in self._window(itr, window_len):
-            rates.append(self._get_rate(direction, swin[0], swin[-1]))
-        return rates
+        rows = self._insert_reports(reports)
+        # after the commit, so a rollback leaves no samples in the store
+        for link, time, rx, tx, now in rows:
+            store.push(link, Sample(float(time), int(rx), int(tx)))
+        return len(rows)
+
+    @transaction.commit_on_success
+    def _insert_reports(self, reports):
+        """Insert reports and update the latest samples of their links in 
+        one transaction. Returns the inserted (link, time, rx, tx, 
+        update_date) rows."""
+        now = datetime.now()
+        rows = [(link, time, rx, tx, now)
+            for (link, time, rx, tx) in reports if rx or tx]
+        if not rows:
+            return rows
+        opts = self.model._meta
+        fields = [opts.get_field(name)
+            for name in ('link', 'time', 'rx', 'tx', 'update_date')]
+        qn = connection.ops.quote_name
+        sql = 'INSERT INTO {0} ({1}) VALUES '.format(qn(opts.db_table),
+            ', '.join([qn(f.column) for f in fields]))
+        values = '({0})'.format(', '.join(['%s'] * len(fields)))
+        cursor = connection.cursor()
+        for i in xrange(0, len(rows), BULK_INSERT_SIZE):
+            chunk = rows[i:i + BULK_INSERT_SIZE]
+            params = []
+            for row in chunk:
+                params.extend([f.get_db_prep_save(v, connection=connection)
+                    for f, v in zip(fields, row)])
+            cursor.execute(sql + ', '.join([values] * len(chunk)), params)
+        transaction.set_dirty()
+        latest = {}
+        for link, time, rx, tx, now in rows:
+            sample = Sample(float(time), int(rx), int(tx))
+            latest.setdefault(int(link), []).append(sample)
+        # each link gets the id of its own newest report: the global newest
+        # id may belong to a transaction that commits later
+        seqs = dict(self.filter(link__in=latest.keys(), update_date__gte=now)
+            .order_by().values('link').annotate(seq=models.Max('id'))
+            .values_list('link', 'seq'))
+        for link, samples in latest.iteritems():
+            LatestBandwidth.objects.push(link, samples, seqs[link])
+        return rows
     
 
 class Bandwidth(models.Model):
@@ -83,7 +246,7 @@ class Bandwidth(models.Model):
             editable=False, db_index=True)
 
     class Meta:
-        ordering = ('-update_date', )
+        ordering = ('-update_date', '-id')
     
     objects = BandwidthManager()
        
@@ -91,7 +254,347 @@ class Bandwidth(models.Model):
         if not self.rx and not self.tx:
             return
         else:
+            created = self.pk is None
             super(Bandwidth, self).save(*args, **kwargs)
+            if created:
+                sample = Sample(float(self.time), int(self.rx), int(self.tx))
+                store.push(self.link, sample)
+                LatestBandwidth.objects.push(self.link, [sample], self.pk)
+            else:
+                # an older sample changed, reload the link on the next rate
+                store.delete(self.link)
+                LatestBandwidth.objects.rebuild(self.link)
     
     def __unicode__(self):
         return 'link {0}'.format(self.link)
+
+
+class LatestBandwidthManager(models.Manager):
+    """Manager that keeps the two most recent reports of each link"""
+    
+    def samples(self, links=None):
+        """Return (link, samples, seq) tuples, samples are newest first.
+        Args:
+            links: list of link ids, or None for all links
+        """
+        qs = self.all()
+        if links is not None:
+            qs = qs.filter(link__in=links)
+        rows = qs.values_list('link', 'time', 'rx', 'tx', 
+            'prev_time', 'prev_rx', 'prev_tx', 'seq')
+        for row in rows:
+            samples = (Sample(*row[1:4]), )
+            if row[4] is not None:
+                samples += (Sample(*row[4:7]), )
+            yield (row[0], samples, row[7])
+
+    def _update(self, assignments, params):
+        """Run UPDATE SET assignments (column, value sql) pairs in order."""
+        qn = connection.ops.quote_name
+        sql = 'UPDATE {0} SET {1} WHERE {2} = %s'.format(
+            qn(self.model._meta.db_table), 
+            ', '.join(['{0} = {1}'.format(qn(c), v) for c, v in assignments]),
+            qn('link'))
+        cursor = connection.cursor()
+        cursor.execute(sql, params)
+        transaction.commit_unless_managed()
+        return cursor.rowcount
+
+    def push(self, link, samples, seq):
+        """Add the newest samples (oldest first) of a link.
+        Args:
+            link: link id
+            samples: list of samples
+            seq: sequence number of the newest sample
+        """
+        now = self.model._meta.get_field('update_date').get_db_prep_save(
+            datetime.now(), connection=connection)
+        fields = ('time', 'rx', 'tx')
+        if len(samples) == 1:
+            # shift the newest sample (assignments run left to right in MySQL)
+            assignments = ([('prev_' + f, connection.ops.quote_name(f)) 
+                for f in fields] + [(f, '%s') for f in fields])
+            params = list(samples[0])
+        else:
+            assignments = ([('prev_' + f, '%s') for f in fields] + 
+                [(f, '%s') for f in fields])
+            params = list(samples[-2]) + list(samples[-1])
+        assignments += [('seq', '%s'), ('update_date', '%s')]
+        params += [seq, now, int(link)]
+        if not self._update(assignments, params):
+            try:
+                if len(samples) == 1:
+                    self.rebuild(link, seq=seq)
+                else:
+                    self.rebuild(link, samples[:-3:-1], seq)
+            except IntegrityError:
+                # a concurrent push added the link first
+                self._update(assignments, params)
+
+    def rebuild(self, link, samples=None, seq=None):
+        """Replace the latest samples (newest first) of a link, read from 
+        its reports by default."""
+        if samples is None:
+            samples = Bandwidth.objects._fetch_latest(link)
+        if seq is None:
+            seq = Bandwidth.objects.last_seq(link)
+        self.filter(link=link).delete()
+        if samples:
+            latest = LatestBandwidth(link=link, time=samples[0].time, 
+                rx=samples[0].rx, tx=samples[0].tx, seq=seq)
+            if len(samples) > 1:
+                latest.prev_time, latest.prev_rx, latest.prev_tx = samples[1]
+            sid = transaction.savepoint()
+            try:
+                latest.save()
+            except IntegrityError:
+                transaction.savepoint_rollback(sid)
+                raise
+            transaction.savepoint_commit(sid)
+
+
+class LatestBandwidth(models.Model):
+    """The two most recent reports of an NDN network link"""
+    link = models.IntegerField(unique=True)
+    time = models.FloatField()
+    rx = models.BigIntegerField()
+    tx = models.BigIntegerField()
+    prev_time = models.FloatField(null=True)
+    prev_rx = models.BigIntegerField(null=True)
+    prev_tx = models.BigIntegerField(null=True)
+    # Bandwidth id of the newest report (or newer)
+    seq = models.IntegerField(default=0)
+    update_date = models.DateTimeField(default=datetime.now, editable=False)
+
+    objects = LatestBandwidthManager()
+
+    def __unicode__(self):
+        return 'link {0}'.format(self.link)
+
+
+def _bucket(date, resolution):
+    """Return the start of the resolution-second bucket holding date."""
+    t = mktime(date.timetuple())
+    return datetime.fromtimestamp(t - t % resolution)
+
+
+class _Aggregate(object):
+    """Running min/max/avg/last of the rates in a rollup bucket"""
+
+    def __init__(self, start):
+        self.start = start
+        self.samples = 0
+        self.rx = [None, None, 0.0, None] # min, max, sum, last
+        self.tx = [None, None, 0.0, None]
+
+    def _add(self, agg, rate):
+        if agg[0] is None or rate < agg[0]: agg[0] = rate
+        if agg[1] is None or rate > agg[1]: agg[1] = rate
+        agg[2] += rate
+        agg[3] = rate
+
+    def add(self, rx, tx):
+        self.samples += 1
+        self._add(self.rx, rx)
+        self._add(self.tx, tx)
+
+    def rollup(self, link, resolution):
+        n = self.samples
+        return BandwidthRollup(link=link, resolution=resolution,
+            start=self.start, samples=n,
+            rx_min=self.rx[0], rx_max=self.rx[1], rx_avg=self.rx[2] / n, 
+            rx_last=self.rx[3],
+            tx_min=self.tx[0], tx_max=self.tx[1], tx_avg=self.tx[2] / n, 
+            tx_last=self.tx[3])
+
+
+class BandwidthRollupManager(models.Manager):
+    """Manager that compacts reports into rollups and queries them"""
+
+    def watermark(self, link):
+        """Return the start of the oldest incomplete bucket of a link."""
+        starts = []
+        for resolution in ROLLUP_RESOLUTIONS:
+            try:
+                starts.append(self.filter(link=link, resolution=resolution)
+                    .order_by('-start').values_list('start', flat=True)[0])
+            except IndexError:
+                return None
+        return min(starts)
+
+    @transaction.commit_on_success
+    def compact(self, link):
+        """Roll up the reports of a link received since the last compaction.
+
+        The last (possibly incomplete) bucket of each resolution is rebuilt.
+        Returns the number of rollups written.
+        """
+        since = self.watermark(link)
+        qs = Bandwidth.objects.filter(link=link).order_by('update_date', 'id')
+        if since is not None:
+            # the report before the bucket gives the bucket's first rate
+            before = qs.filter(update_date__lt=since).reverse()
+            prev = list(before.values_list(
+                'update_date', 'time', 'rx', 'tx')[:1])
+            prev = prev[0] if prev else None
+            qs = qs.filter(update_date__gte=since)
+            self.filter(link=link, start__gte=since).delete()
+        else:
+            prev = None
+        rows = qs.values_list('update_date', 'time', 'rx', 'tx').iterator()
+        count = 0
+        for rollup in self._rollups(link, rows, prev, ROLLUP_RESOLUTIONS):
+            rollup.save()
+            count += 1
+        return count
+
+    def _rollups(self, link, rows, prev, resolutions):
+        """Yield the (unsaved) rollups of (update_date, time, rx, tx) 
+        reports, oldest first, that follow the report prev (or None)."""
+        aggs = dict([(res, None) for res in resolutions])
+        for row in rows:
+            if prev is not None:
+                rx, tx = Bandwidth.objects._pair_rate(Sample(*prev[1:]), 
+                    Sample(*row[1:]))
+                for res in resolutions:
+                    start = _bucket(row[0], res)
+                    agg = aggs[res]
+                    if agg is None or agg.start != start:
+                        if agg is not None:
+                            yield agg.rollup(link, res)
+                        agg = aggs[res] = _Aggregate(start)
+                    agg.add(rx, tx)
+            prev = row
+        for res, agg in aggs.items():
+            if agg is not None:
+                yield agg.rollup(link, res)
+
+    def expire(self, link, now=None):
+        """Delete raw reports of a link that are rolled up and older than 
+        RAW_RETENTION seconds. Returns the cutoff date (or None).
+
+        The newest report before the watermark is kept: compact needs it for
+        the first rate of the bucket it rebuilds.
+        """
+        if RAW_RETENTION is None:
+            return None
+        since = self.watermark(link)
+        if since is None:
+            return None
+        before = list(Bandwidth.objects.filter(link=link, 
+            update_date__lt=since).order_by('-update_date')
+            .values_list('update_date', flat=True)[:1])
+        if not before:
+            return None
+        now = now or datetime.now()
+        cutoff = min(before[0], now - timedelta(seconds=RAW_RETENTION))
+        # QuerySet.delete loads every instance, delete with a single statement
+        qn = connection.ops.quote_name
+        opts = Bandwidth._meta
+        connection.cursor().execute(
+            'DELETE FROM {0} WHERE {1} = %s AND {2} < %s'.format(
+                qn(opts.db_table), qn(opts.get_field('link').column),
+                qn(opts.get_field('update_date').column)), 
+            [link, opts.get_field('update_date').get_db_prep_save(
+                cutoff, connection=connection)])
+        transaction.commit_unless_managed()
+        store.delete(link)
+        return cutoff
+
+    def series(self, link, start, end=None, points=100, aggregate='avg'):
+        """Return lists of (rx, tx) rates from the coarsest rollup that has 
+        at least points buckets between start and end, or None if no rollup 
+        does or the link has no rollups in the range.
+
+        The newest bucket, and any after it (compact_bandwidth may lag), are
+        rolled up from the raw reports.
+
+        Args:
+            link: link id
+            start, end: datetime range (end defaults to now)
+            points: minimum number of rates
+            aggregate: 'min', 'max', 'avg' or 'last'
+        """
+        end = end or datetime.now()
+        span = mktime(end.timetuple()) - mktime(start.timetuple())
+        for res in sorted(ROLLUP_RESOLUTIONS, reverse=True):
+            if span / res >= points:
+                break
+        else:
+            return None
+        fields = ('rx_' + aggregate, 'tx_' + aggregate)
+        rows = list(self.filter(link=link, resolution=res, 
+            start__gte=_bucket(start, res), start__lt=end).order_by('start')
+            .values_list('start', *fields))
+        if not rows:
+            return None
+        tail = rows[-1][0]
+        reports = Bandwidth.objects.filter(link=link).order_by('update_date',
+            'id')
+        prev = list(reports.filter(update_date__lt=tail).reverse()
+            .values_list('update_date', 'time', 'rx', 'tx')[:1])
+        reports = (reports.filter(update_date__gte=tail, update_date__lt=end)
+            .values_list('update_date', 'time', 'rx', 'tx').iterator())
+        recent = [[r.start] + [getattr(r, f) for f in fields] for r in 
+            self._rollups(link, reports, prev and prev[0] or None, [res])]
+        if recent:
+            rows = rows[:-1] + recent
+        return ([rx for start, rx, tx in rows], [tx for start, rx, tx in rows])
+
+    def rates(self, direction, link, start, end=None, points=100, 
+            aggregate='avg'):
+        """Return a list of rates from the coarsest rollup (see series)
+
+        Args:
+            direction: 'rx' or 'tx' traffic
+        """
+        series = self.series(link, start, end, points, aggregate)
+        if series is None:
+            return None
+        return series[0] if direction == 'rx' else series[1]
+
+
+class BandwidthRollup(models.Model):
+    """Rates on an NDN network link aggregated over a time bucket"""
+    link = models.IntegerField()
+    resolution = models.IntegerField() # bucket length (s)
+    start = models.DateTimeField()
+    samples = models.IntegerField()
+    rx_min = models.FloatField()
+    rx_max = models.FloatField()
+    rx_avg = models.FloatField()
+    rx_last = models.FloatField()
+    tx_min = models.FloatField()
+    tx_max = models.FloatField()
+    tx_avg = models.FloatField()
+    tx_last = models.FloatField()
+
+    class Meta:
+        ordering = ('-start', )
+        unique_together = (('link', 'resolution', 'start'), )
+
+    objects = BandwidthRollupManager()
+
+    def __unicode__(self):
+        return 'link {0} ({1}s)'.format(self.link, self.resolution)
+
+
+# links of the reports being deleted, per thread
+_deleting = threading.local()
+
+def _bandwidth_deleting(sender, instance, **kwargs):
+    if not hasattr(_deleting, 'links'):
+        _deleting.links = set()
+    _deleting.links.add(instance.link)
+
+def _bandwidth_deleted(sender, instance, **kwargs):
+    # all reports of a delete are gone before the first post_delete signal,
+    # so each link is rebuilt once
+    links = getattr(_deleting, 'links', set())
+    if instance.link in links:
+        links.discard(instance.link)
+        store.delete(instance.link)
+        LatestBandwidth.objects.rebuild(instance.link)
+
+pre_delete.connect(_bandwidth_deleting, sender=Bandwidth)
+post_delete.connect(_bandwidth_deleted, sender=Bandwidth)
@@ -0,0 +1,109 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Windowed rates over columns of traffic samples.
+
+The rates match BandwidthManager._get_rate over a sliding window: the bits
+delta over the time delta between the first and last sample in the window,
+or 0 if the time delta is 0. Negative deltas (counter roll overs) are kept.
+Rate series are downsampled for display with Largest-Triangle-Three-Buckets.
+NumPy is used if it is installed, otherwise array.array and a Python loop.
+"""
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def columns(rows):
+    """Return (time, rx, tx) columns from an iterable of (time, rx, tx)."""
+    rows = list(rows)
+    n = len(rows)
+    if numpy is not None:
+        return (numpy.fromiter((r[0] for r in rows), numpy.float64, n),
+                numpy.fromiter((r[1] for r in rows), numpy.int64, n),
+                numpy.fromiter((r[2] for r in rows), numpy.int64, n))
+    return (array('d', [r[0] for r in rows]),
+            array('d', [r[1] for r in rows]),
+            array('d', [r[2] for r in rows]))
+
+
+def window_rates(time, rx, tx, window_len):
+    """Return lists of (rx, tx) rates over a sliding window of samples.
+
+    Args:
+        time, rx, tx: columns of samples (see columns), oldest first
+        window_len: number of samples in the window
+    """
+    n = len(time) - window_len + 1
+    if n <= 0:
+        return ([], [])
+    if numpy is not None:
+        last = window_len - 1
+        dt = time[last:] - time[:n]
+        zero = dt == 0
+        dt[zero] = 1.0
+        rx_rates = (rx[last:] - rx[:n]) / dt
+        tx_rates = (tx[last:] - tx[:n]) / dt
+        rx_rates[zero] = 0.0
+        tx_rates[zero] = 0.0
+        return (rx_rates.tolist(), tx_rates.tolist())
+    rx_rates, tx_rates = [0.0] * n, [0.0] * n
+    for i in xrange(n):
+        j = i + window_len - 1
+        dt = time[j] - time[i]
+        if dt:
+            rx_rates[i] = (rx[j] - rx[i]) / dt
+            tx_rates[i] = (tx[j] - tx[i]) / dt
+    return (rx_rates, tx_rates)
+
+def lttb(values, points):
+    """Return a list of at most points values of a series, picked by the
+    Largest-Triangle-Three-Buckets algorithm (see lttb_indices).
+    """
+    return [values[i] for i in lttb_indices(values, points)]
+
+
+def lttb_indices(values, points):
+    """Return the indices of at most points values of a series, picked by 
+    the Largest-Triangle-Three-Buckets algorithm (x is the index of a value).
+
+    The first and last values are kept. The other values are split in 
+    points - 2 buckets and each bucket keeps the value that forms the 
+    largest triangle with the previous pick and the average of the next 
+    bucket, so peaks and dips survive. points below 3 are taken as 3.
+    """
+    n = len(values)
+    points = max(points, 3)
+    if n <= points:
+        return range(n)
+    if numpy is not None:
+        values = numpy.asarray(values, numpy.float64)
+    def bound(k):
+        # start of the k-th bucket
+        return min(k * (n - 2) // (points - 2) + 1, n)
+    picked = [0]
+    a = 0
+    for i in xrange(points - 2):
+        start, end, next_end = bound(i), bound(i + 1), bound(i + 2)
+        next_x = (end + next_end - 1) / 2.0
+        ax, ay = a, values[a]
+        if numpy is not None:
+            next_y = values[end:next_end].mean()
+            x = numpy.arange(start, end)
+            area = numpy.abs((ax - next_x) * (values[start:end] - ay) - 
+                (ax - x) * (next_y - ay))
+            a = start + int(area.argmax())
+        else:
+            next_y = sum(values[end:next_end]) / float(next_end - end)
+            area_max = -1.0
+            for j in xrange(start, end):
+                area = abs((ax - next_x) * (values[j] - ay) - 
+                    (ax - j) * (next_y - ay))
+                if area > area_max:
+                    area_max, a = area, j
+        picked.append(a)
+    picked.append(n - 1)
+    return picked
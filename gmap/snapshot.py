@@ -0,0 +1,115 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Snapshot of the rates of all links, shared by all polling clients.
+
+The rates are computed, and serialized to JSON, once per update interval
+(in each process). xhr_bw serves the JSON payload as-is for all links and
+picks other link sets out of the snapshot. Each link carries the sequence
+number of its last (rounded) rate change, so clients can ask for the links
+changed since the sequence number of a snapshot.
+
+Sequence numbers are report ids, which transactions commit out of order: a
+report may become visible after a snapshot advertised a higher sequence
+number. A change is therefore numbered after the previous snapshot (the
+report's id, or the previous snapshot's sequence number plus one if that is
+higher), so it is newer than every sequence number clients have been sent.
+
+Version 2 payloads are compact: parallel arrays of link ids and rates, 
+{"v": 2, "ts": <timestamp>, "seq": <seq>, "ids": [..], "rx": [..], "tx": [..]}.
+"""
+import json
+import threading
+import time
+from gmap.models import Bandwidth, LatestBandwidth
+
+
+class Snapshot(object):
+    """Rates of all links at a point in time"""
+
+    def __init__(self, bucket, timestamp, data, changed, seqs):
+        """
+        Args:
+            bucket: update interval number of the snapshot
+            timestamp: time the rates were computed (s since the epoch)
+            data: list of {'id':.., 'rx':.., 'tx':..} dictionaries
+            changed: dictionary of link id to the sequence number of its 
+                last rate change
+            seqs: dictionary of link id to the sequence number of its 
+                newest report
+        """
+        self.bucket = bucket
+        self.timestamp = timestamp
+        self.data = data
+        self.changed = changed
+        self.seqs = seqs
+        self.seq = max([0] + changed.values())
+        self.rates = dict([(int(d['id']), d) for d in data])
+        # Backward compatability
+        self.payload = json.dumps(data[0] if len(data) == 1 else data)
+        self.compact_payload = self.compact(data)
+
+    def select(self, links):
+        """Return the rate dictionaries of links (zero if unknown)."""
+        return [self.rates.get(int(link)) or {'id':str(link), 'rx':0.0, 'tx':0.0}
+            for link in links]
+
+    def compact(self, data):
+        """Return the version 2 payload of rate dictionaries."""
+        return json.dumps({'v': 2, 'ts': round(self.timestamp, 3), 
+            'seq': self.seq, 'ids': [int(d['id']) for d in data], 
+            'rx': [d['rx'] for d in data], 'tx': [d['tx'] for d in data]},
+            separators=(',', ':'))
+
+    def delta(self, since):
+        """Return the rate dictionaries of links changed after since."""
+        return [d for d in self.data if self.changed[int(d['id'])] > since]
+
+
+class RateSnapshot(object):
+    """Builds a Snapshot at most once per update interval"""
+
+    def __init__(self, interval, divisor=1000.0, decimal_points=1):
+        """
+        Args:
+            interval: update interval (s)
+            divisor: rates are divided by divisor (e.g. Bps to Kbps)
+            decimal_points: rates are rounded to decimal_points
+        """
+        self.interval = interval
+        self.divisor = divisor
+        self.decimal_points = decimal_points
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def _build(self, bucket):
+        prev = self._snapshot
+        data, changed, seqs = [], {}, {}
+        for link, samples, seq in sorted(LatestBandwidth.objects.samples()):
+            rx, tx = Bandwidth.objects._latest_rate(samples)
+            rx = round(rx/self.divisor, self.decimal_points)
+            tx = round(tx/self.divisor, self.decimal_points)
+            d = {'id':str(link), 'rx':rx, 'tx':tx}
+            if prev is not None and prev.rates.get(link) == d:
+                changed[link] = prev.changed[link]
+            else:
+                # after every sequence number sent before (see above)
+                changed[link] = max(seq, prev and prev.seq + 1 or 0)
+            seqs[link] = seq
+            data.append(d)
+        return Snapshot(bucket, time.time(), data, changed, seqs)
+
+    def get(self):
+        """Return the snapshot of the current update interval."""
+        bucket = int(time.time() / self.interval)
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.bucket != bucket:
+            with self._lock:
+                # another thread may have built it while we waited
+                snapshot = self._snapshot
+                if snapshot is None or snapshot.bucket != bucket:
+                    snapshot = self._snapshot = self._build(bucket)
+        return snapshot
+
+    def clear(self):
+        self._snapshot = None
@@ -0,0 +1,221 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""Per-link cache of sparkline rates, extended with new reports only.
+
+A link's entry holds its newest GMAP_SPARKLINE_CACHE_SIZE windowed rates, the
+date each rate's window starts and the reports of the last (partial) window.
+A request reads only the reports after the newest cached one, computes their
+rates and drops the oldest rates, so its cost is proportional to the new
+reports. Ranges the cache does not hold are computed from the database.
+Entries are kept per process and dropped when reports of the link are
+deleted.
+
+Transactions may commit reports out of id order, so updates re-read the
+reports of the last GMAP_SPARKLINE_OVERLAP seconds and skip the ones already
+cached; a report that sorts before the newest cached one reloads the entry.
+Reports committed more than GMAP_SPARKLINE_OVERLAP seconds late are missed
+until the entry is reloaded.
+"""
+import threading
+from bisect import bisect_left
+from collections import deque
+from datetime import datetime, timedelta
+from django.conf import settings
+from django.db.models.signals import post_delete
+from gmap.models import Bandwidth, SLIDING_WINDOW_LEN
+from gmap.rates import columns, window_rates
+
+# rates kept per link
+SPARKLINE_CACHE_SIZE = getattr(settings, 'GMAP_SPARKLINE_CACHE_SIZE',
+    getattr(settings, 'GMAP_SPARKLINE_LIMIT', 300))
+# updates re-read the reports of the last SPARKLINE_OVERLAP seconds
+SPARKLINE_OVERLAP = getattr(settings, 'GMAP_SPARKLINE_OVERLAP', 10)
+
+
+class _Series(object):
+    """Cached rates of a link"""
+
+    def __init__(self, size, window_len, overlap):
+        self.size = size
+        self.window_len = window_len
+        self.overlap = timedelta(seconds=overlap)
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        """Drop all cached rates and reports."""
+        size = self.size
+        self.rx = deque(maxlen=size)
+        self.tx = deque(maxlen=size)
+        # update_date of the first report in the window of each rate
+        self.starts = deque(maxlen=size)
+        # id of the last report in the window of each rate
+        self.seqs = deque(maxlen=size)
+        # the newest (id, update_date, time, rx, tx) reports
+        self.window = deque(maxlen=self.window_len - 1)
+        # (update_date, id) of the reports of the last overlap seconds
+        self.recent = deque()
+        self.recent_ids = set()
+        self.seq = 0 # id of the newest report
+        self.last = 0 # largest report id
+        self.date = None # update_date of the newest report
+        self.complete = True # no older rates were dropped
+
+    def extend(self, rows):
+        """Add (id, update_date, time, rx, tx) reports, oldest first."""
+        if not rows:
+            return
+        reports = list(self.window) + list(rows)
+        rx, tx = window_rates(*columns([r[2:] for r in reports]),
+            window_len=self.window_len)
+        if len(self.rx) + len(rx) > self.rx.maxlen:
+            self.complete = False
+        self.rx.extend(rx)
+        self.tx.extend(tx)
+        self.starts.extend([r[1] for r in reports[:len(rx)]])
+        self.seqs.extend([r[0] for r in reports[self.window_len - 1:]])
+        self.window.extend(reports)
+        self.seq, self.date = reports[-1][:2]
+        self.last = max([self.last] + [r[0] for r in rows])
+        for r in rows:
+            self.recent.append((r[1], r[0]))
+            self.recent_ids.add(r[0])
+        while self.recent[0][0] < self.date - self.overlap:
+            self.recent_ids.discard(self.recent.popleft()[1])
+
+    def rates(self, seconds=None, limit=None):
+        """Return (rx, tx) rate lists, or None if the range is not cached."""
+        rx, tx = list(self.rx), list(self.tx)
+        if seconds is not None:
+            since = datetime.now() - timedelta(seconds=seconds)
+            if not self.complete and (not rx or self.starts[0] >= since):
+                return None
+            i = bisect_left(list(self.starts), since)
+            rx, tx = rx[i:], tx[i:]
+        elif limit is not None and len(rx) < limit and not self.complete:
+            return None
+        if limit is not None:
+            rx, tx = rx[-limit:], tx[-limit:]
+        return (rx, tx)
+
+    def rates_after(self, after, limit=None):
+        """Return (rx, tx) lists of the cached rates of reports after after."""
+        # seqs are in update_date order, which is not id order if reports
+        # were committed out of order
+        new = [seq > after for seq in self.seqs]
+        rx = [r for r, n in zip(self.rx, new) if n]
+        tx = [t for t, n in zip(self.tx, new) if n]
+        if limit is not None:
+            rx, tx = rx[-limit:], tx[-limit:]
+        return (rx, tx)
+
+
+class SparkLineCache(object):
+    """Sparkline rates of links, extended as reports arrive"""
+
+    def __init__(self, size=SPARKLINE_CACHE_SIZE,
+            window_len=SLIDING_WINDOW_LEN, overlap=SPARKLINE_OVERLAP):
+        """
+        Args:
+            size: number of rates kept per link
+            window_len: number of reports in the window of a rate
+            overlap: updates re-read the reports of the last overlap seconds
+        """
+        self.size = size
+        self.window_len = window_len
+        self.overlap = overlap
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _reports(self, link):
+        return Bandwidth.objects.filter(link=link).values_list('id',
+            'update_date', 'time', 'rx', 'tx')
+
+    def _load(self, series, link):
+        """Read the newest reports of a link into an empty series."""
+        n = self.size + self.window_len - 1
+        rows = list(self._reports(link).order_by('-update_date', '-id')[:n])
+        rows.reverse()
+        series.extend(rows)
+        series.complete = len(rows) < n
+
+    def _update(self, series, link):
+        """Read the reports after the newest one of a series, or reload it
+        if an older report was committed late."""
+        qs = self._reports(link)
+        if series.date is not None:
+            qs = qs.filter(update_date__gte=series.date - series.overlap)
+        rows = [row for row in qs.order_by('update_date', 'id')
+            if row[0] not in series.recent_ids]
+        if rows and series.date is not None and \
+                (rows[0][1], rows[0][0]) < (series.date, series.seq):
+            series.clear()
+            self._load(series, link)
+        else:
+            series.extend(rows)
+
+    def _read(self, link, seq, read):
+        """Return read(series) of the link's series, brought up to date 
+        unless it is cached up to the sequence number seq."""
+        link = int(link)
+        series = self._series.get(link)
+        loaded = False
+        if series is None:
+            with self._lock:
+                series = self._series.get(link)
+                if series is None:
+                    series = _Series(self.size, self.window_len, 
+                        self.overlap)
+                    self._load(series, link)
+                    self._series[link] = series
+                    loaded = True
+        with series.lock:
+            if not loaded and (seq is None or seq > series.last):
+                self._update(series, link)
+            return read(series)
+
+    def rates(self, link, seconds=None, limit=None, seq=None):
+        """Return lists of (rx, tx) average rates (see
+        BandwidthManager.window_rates).
+
+        Args:
+            link: link id
+            seconds: only use reports received in the last seconds seconds
+            limit: return at most limit (most recent) rates
+            seq: sequence number of the link's newest report, if known
+                (no query is made if the link's rates are cached up to it)
+        """
+        rates = self._read(link, seq, 
+            lambda series: series.rates(seconds, limit))
+        if rates is None:
+            return Bandwidth.objects.window_rates(link, self.window_len,
+                seconds, limit)
+        return rates
+
+    def rates_after(self, link, after, limit=None, seq=None):
+        """Return (rx, tx, seq): lists of the cached rates whose window ends
+        with a report after the sequence number after, and the sequence 
+        number of the link's newest report (0 if it has none).
+
+        Args:
+            limit: return at most limit (most recent) rates
+            seq: see rates
+        """
+        return self._read(link, seq, 
+            lambda series: series.rates_after(after, limit) + (series.seq, ))
+
+    def delete(self, link):
+        self._series.pop(int(link), None)
+
+    def clear(self):
+        self._series.clear()
+
+
+sparkline_cache = SparkLineCache()
+
+
+def _bandwidth_deleted(sender, instance, **kwargs):
+    sparkline_cache.delete(instance.link)
+
+post_delete.connect(_bandwidth_deleted, sender=Bandwidth)
@@ -0,0 +1,5 @@
+-- Covering index for per-link queries ordered by update_date.
+-- BandwidthManager selects (time, rx, tx) of a link ordered by update_date;
+-- the database answers these queries from the index alone.
+CREATE INDEX gmap_bandwidth_link_update_date 
+    ON gmap_bandwidth (link, update_date, time, rx, tx);
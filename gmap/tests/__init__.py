@@ -1 +1,2 @@
 from gmap.tests.test_bandwidth import *  
+from gmap.tests.test_gviz import *
@@ -4,7 +4,9 @@
 """gmap tests"""
 from django.conf import settings
 from django.test import TestCase
+from gmap.latest import Sample, store
 from gmap.models import Bandwidth
+from gmap.sparklines import SparkLineCache, sparkline_cache
 
 class BandwidthSaveTest(TestCase):
     """Test Bandwidth save override method"""
@@ -12,6 +14,7 @@ class BandwidthSaveTest(TestCase):
     time = 1.
     def setUp(self):
         Bandwidth.objects.all().delete()
+        store.clear()
         
     def _test_rx_tx(self, rx, tx):
         b = Bandwidth.objects.filter(link=self.link)[0]
@@ -43,6 +46,7 @@ class BandwidthAddTest(TestCase):
     """Test view to add Bandwidth"""    
     def setUp(self):
         Bandwidth.objects.all().delete()
+        store.clear()
     
     def test_bw(self):
         from django.core.urlresolvers import reverse 
@@ -56,6 +60,7 @@ class BandwidthXHRTest(TestCase):
     """Test XMLHttpRequests"""
     def setUp(self):
         Bandwidth.objects.all().delete()
+        store.clear()
         self.b = Bandwidth.objects.create(link=1, time=1., rx=1, tx=1)
     
     def test_xhr_request(self):
@@ -73,6 +78,7 @@ class BandwidthManagerRateTest(TestCase):
     """Test BandwidthManager rate"""
     def setUp(self):
         Bandwidth.objects.all().delete() # if any initial_data
+        store.clear()
         Bandwidth.objects.create(link=1, time=1., rx=1, tx=1)
         Bandwidth.objects.create(link=2, time=1., rx=1, tx=1)
         Bandwidth.objects.create(link=2, time=2., rx=2, tx=2)
@@ -126,6 +132,7 @@ class BandwidthManagerRatesTest(TestCase):
     """Test BandwidthManager rate"""
     def setUp(self):
         Bandwidth.objects.all().delete() # if any initial_data
+        store.clear()
 
     def test_single_value_rates(self):
         Bandwidth.objects.create(link=1, time=1., rx=1, tx=1)
@@ -148,4 +155,1020 @@ class BandwidthManagerRatesTest(TestCase):
         self.assertEqual(Bandwidth.objects.rates('rx', 1, 2), [3., 44., 1.])
         self.assertEqual(Bandwidth.objects.rates('tx', 1, 2), [0., 0., 0.])    
     
-    
\ No newline at end of file
+    def test_limit_rates(self):
+        """Test the most recent rates are returned"""
+        for i, rx in enumerate([1, 2, 4, 8, 16]):
+            Bandwidth.objects.create(link=1, time=float(i), rx=rx, tx=rx)
+        self.assertEqual(Bandwidth.objects.rates('rx', 1, 2, limit=2), [4., 8.])
+        self.assertEqual(Bandwidth.objects.rates('rx', 1, 3, limit=1), [6.])
+    
+    def test_seconds_rates(self):
+        """Test only recent reports are used"""
+        from datetime import datetime, timedelta
+        old = datetime.now() - timedelta(seconds=60)
+        Bandwidth.objects.create(link=1, time=1., rx=1, tx=1, update_date=old)
+        Bandwidth.objects.create(link=1, time=2., rx=2, tx=1)
+        Bandwidth.objects.create(link=1, time=3., rx=4, tx=1)
+        self.assertEqual(Bandwidth.objects.rates('rx', 1, 2, seconds=30), [2.])
+    
+    
+class BandwidthBatchTest(TestCase):
+    """Test batch reports"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+    
+    def _post(self, data):
+        from django.core.urlresolvers import reverse 
+        return self.client.post(reverse('bw_batch'), data, 
+                content_type='text/plain')
+    
+    def test_add_reports(self):
+        """Test zero bit reports are skipped."""
+        reports = [(1, 1., 1, 1), (1, 2., 0, 0), (2, 1., 0, 5)]
+        self.assertEqual(Bandwidth.objects.add_reports(reports), 2)
+        rows = Bandwidth.objects.order_by('link').values_list(
+                'link', 'time', 'rx', 'tx')
+        self.assertEqual(list(rows), [(1, 1., 1, 1), (2, 1., 0, 5)])
+    
+    def test_batch_order(self):
+        """Test reports of a batch (one update_date) keep their order"""
+        Bandwidth.objects.add_reports([(1, float(t), 1000 * t, 2000 * t)
+            for t in range(1, 21)])
+        self.assertEqual(Bandwidth.objects.rate(1), (1000., 2000.))
+        rx, tx = Bandwidth.objects.window_rates(1)
+        self.assertEqual((set(rx), set(tx)), (set([1000.]), set([2000.])))
+        rates = Bandwidth.objects.window_rates_many([1])
+        self.assertEqual(rates[1], (rx, tx))
+    
+    def test_lines(self):
+        """Test newline-delimited reports."""
+        r = self._post('1/1.0/1/2\n2 1.0 3 4\n')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(Bandwidth.objects.count(), 2)
+    
+    def test_json(self):
+        """Test JSON array reports."""
+        r = self._post('[[1, 1.0, 1, 2], [1, 2.0, 3, 4]]')
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(Bandwidth.objects.filter(link=1).count(), 2)
+    
+    def test_invalid(self):
+        """Test that a bad report rejects the whole batch."""
+        r = self._post('1/1.0/1/2\n2/x/3/4\n')
+        self.assertEqual(r.status_code, 400)
+        self.assertEqual(Bandwidth.objects.count(), 0)
+        for data in ('1/inf/1/2', '1/nan/1/2', '1.9/1.0/1/2', '1/1.0/1.5/2',
+                '[[1, 1e400, 1, 2]]', '[[true, 1.0, 1, 2]]', 
+                '[[1.9, 1.0, 1, 2]]', '[[1, 1.0, 1, false]]',
+                '[[1, 1.0, 2.0, 2]]'):
+            self.assertEqual(self._post(data).status_code, 400, data)
+        self.assertEqual(Bandwidth.objects.count(), 0)
+    
+
+class WriteBehindBufferTest(TestCase):
+    """Test write-behind buffer"""
+    def setUp(self):
+        from gmap.ingest import WriteBehindBuffer
+        Bandwidth.objects.all().delete()
+        store.clear()
+        self.buf = WriteBehindBuffer(max_size=2, autostart=False)
+    
+    def test_flush(self):
+        """Test buffered reports are stored on flush."""
+        self.assertTrue(self.buf.put((1, 1., 1, 1)))
+        self.assertEqual(Bandwidth.objects.count(), 0)
+        self.buf.flush()
+        self.assertEqual(Bandwidth.objects.count(), 1)
+        self.assertEqual(self.buf.stats()['flushed'], 1)
+    
+    def test_dropped(self):
+        """Test batches are dropped whole when they do not fit."""
+        reports = [(1, 1., 1, 1), (1, 2., 2, 2), (1, 3., 3, 3)]
+        self.assertEqual(self.buf.put_many(reports), 0)
+        stats = self.buf.stats()
+        self.assertEqual((stats['queue_depth'], stats['dropped']), (0, 3))
+        self.assertEqual(self.buf.put_many(reports[:1]), 1)
+        self.assertEqual(self.buf.put_many(reports[1:]), 0)
+        self.assertEqual(self.buf.put_many(reports[1:2]), 1)
+        self.assertFalse(self.buf.put(reports[2]))
+        stats = self.buf.stats()
+        self.assertEqual((stats['queue_depth'], stats['dropped']), (2, 6))
+    
+
+class LatestStoreTest(TestCase):
+    """Test latest samples store"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.create(link=1, time=1., rx=1, tx=1)
+        Bandwidth.objects.create(link=1, time=2., rx=2, tx=2)
+    
+    def test_rate_cached(self):
+        """Test rate is read from the database once."""
+        self.assertEqual(Bandwidth.objects.rate(1), (1.0, 1.0))
+        self.assertNumQueries(0, Bandwidth.objects.rate, 1)
+    
+    def test_push(self):
+        """Test new reports update the cached rate."""
+        Bandwidth.objects.rate(1)
+        Bandwidth.objects.create(link=1, time=3., rx=4, tx=5)
+        self.assertNumQueries(0, Bandwidth.objects.rate, 1)
+        self.assertEqual(Bandwidth.objects.rate(1), (2.0, 3.0))
+        Bandwidth.objects.add_reports([(1, 4., 8, 5)])
+        self.assertEqual(Bandwidth.objects.rate(1), (4.0, 0.0))
+    
+    def test_update(self):
+        """Test changed reports are reloaded."""
+        Bandwidth.objects.rate(1)
+        b = Bandwidth.objects.get(link=1, time=2.)
+        b.rx = 3
+        b.save()
+        self.assertEqual(Bandwidth.objects.rate(1), (2.0, 1.0))
+    
+    def test_expire(self):
+        """Test locmem samples expire (other processes add reports)"""
+        from gmap.latest import LocMemStore
+        s = LocMemStore(timeout=0)
+        s.set(1, [Sample(2., 2, 2), Sample(1., 1, 1)])
+        self.assertEqual(s.get(1), None)
+        s.push(1, Sample(3., 3, 3))
+        self.assertEqual(s.get(1), None)
+        s = LocMemStore(timeout=60)
+        s.set(1, [Sample(2., 2, 2)])
+        s.push(1, Sample(3., 3, 3))
+        self.assertEqual(s.get(1), (Sample(3., 3, 3), Sample(2., 2, 2)))
+    
+    def test_rollback(self):
+        """Test samples are pushed only after the reports commit"""
+        from gmap.models import LatestBandwidth
+        Bandwidth.objects.rate(1)
+        push = LatestBandwidth.objects.push
+        def fail(*args):
+            raise RuntimeError
+        LatestBandwidth.objects.push = fail
+        try:
+            self.assertRaises(RuntimeError, Bandwidth.objects.add_reports, 
+                [(1, 3., 10, 10)])
+        finally:
+            LatestBandwidth.objects.push = push
+        self.assertEqual(store.get(1)[0], Sample(2., 2, 2))
+    
+
+class BandwidthRollupTest(TestCase):
+    """Test BandwidthRollupManager compaction"""
+    def setUp(self):
+        from datetime import datetime, timedelta
+        from gmap.models import BandwidthRollup
+        Bandwidth.objects.all().delete()
+        store.clear()
+        self.start = datetime(2012, 1, 1, 0, 0, 0)
+        # 1 report per 30 s for 4 min, rx rate 1 Bps, tx rate 2 Bps
+        for i in range(9):
+            Bandwidth.objects.create(link=1, time=30. * i, rx=1 + 30 * i, 
+                tx=1 + 60 * i, update_date=self.start + timedelta(seconds=30*i))
+        self.rollups = BandwidthRollup.objects
+    
+    def test_compact(self):
+        """Test one rollup per bucket"""
+        self.rollups.compact(1)
+        minutes = self.rollups.filter(link=1, resolution=60).order_by('start')
+        self.assertEqual(minutes.count(), 5)
+        self.assertEqual([r.samples for r in minutes], [1, 2, 2, 2, 1])
+        self.assertEqual(set([(r.rx_avg, r.tx_max) for r in minutes]), 
+                set([(1.0, 2.0)]))
+    
+    def test_incremental(self):
+        """Test compaction rebuilds the last bucket only"""
+        from datetime import timedelta
+        self.rollups.compact(1)
+        Bandwidth.objects.create(link=1, time=270., rx=1 + 270 * 3, tx=541, 
+                update_date=self.start + timedelta(seconds=270))
+        self.rollups.compact(1)
+        minutes = self.rollups.filter(link=1, resolution=60).order_by('start')
+        self.assertEqual([r.samples for r in minutes], [1, 2, 2, 2, 2])
+        self.assertEqual(minutes.reverse()[0].rx_max, 19.0)
+    
+    def test_expire(self):
+        """Test only rolled-up reports expire"""
+        from datetime import timedelta
+        Bandwidth.objects.create(link=1, time=5400., rx=5401, tx=10801, 
+                update_date=self.start + timedelta(seconds=5400))
+        self.rollups.compact(1)
+        cutoff = self.rollups.expire(1, now=self.start + timedelta(days=7))
+        # the last hour is not rolled up, the report before it is kept
+        self.assertEqual(cutoff, self.start + timedelta(seconds=240))
+        self.assertEqual(Bandwidth.objects.filter(link=1).count(), 2)
+    
+    def test_compact_after_expire(self):
+        """Test compaction after expiry rebuilds the same rollups"""
+        from datetime import timedelta
+        Bandwidth.objects.create(link=1, time=5400., rx=5401, tx=10801, 
+                update_date=self.start + timedelta(seconds=5400))
+        fields = ('resolution', 'start', 'samples', 'rx_avg', 'tx_max')
+        rollups = self.rollups.filter(link=1).order_by('resolution', 'start')
+        self.rollups.compact(1)
+        compacted = list(rollups.values_list(*fields))
+        self.rollups.expire(1, now=self.start + timedelta(days=7))
+        self.rollups.compact(1)
+        self.assertEqual(list(rollups.values_list(*fields)), compacted)
+    
+    def test_rates(self):
+        """Test the coarsest resolution with enough points is used"""
+        from datetime import timedelta
+        self.rollups.compact(1)
+        end = self.start + timedelta(seconds=300)
+        self.assertEqual(self.rollups.rates('tx', 1, self.start, end, 5), 
+                [2.0] * 5)
+        self.assertEqual(self.rollups.rates('tx', 1, self.start, end, 6), 
+                None)
+    
+    def test_series_behind(self):
+        """Test reports after the newest rollup are rolled up on read"""
+        from datetime import timedelta
+        end = self.start + timedelta(seconds=660)
+        self.assertEqual(self.rollups.series(1, self.start, end, 5), None)
+        self.rollups.compact(1)
+        for i in range(9, 21):
+            Bandwidth.objects.create(link=1, time=30. * i, rx=1 + 30 * i, 
+                tx=1 + 60 * i, update_date=self.start + timedelta(seconds=30*i))
+        series = self.rollups.series(1, self.start, end, 5)
+        self.assertEqual(series, ([1.0] * 11, [2.0] * 11))
+        self.rollups.compact(1)
+        self.assertEqual(self.rollups.series(1, self.start, end, 5), series)
+    
+
+class WindowRatesTest(TestCase):
+    """Test column rates against the sample generator"""
+    def test_window_rates(self):
+        from gmap import rates
+        rows = [(1., 1, 1), (1., 5, 2), (3., 9, 3), (4., 7, 9), (8., 15, 9)]
+        manager = Bandwidth.objects
+        for w in (2, 3, 4):
+            for direction, result in zip(('rx', 'tx'), 
+                    rates.window_rates(*rates.columns(rows), window_len=w)):
+                samples = iter([Sample(*row) for row in rows])
+                expected = [manager._get_rate(direction, s[0], s[-1])
+                    for s in manager._window(samples, w)]
+                self.assertEqual(result, expected)
+
+    def test_lttb(self):
+        """Test downsampling keeps the ends and peaks"""
+        from gmap.rates import lttb
+        values = [0.] * 50 + [100.] + [0.] * 50 + [-5.] + [1.] * 100
+        result = lttb(values, 10)
+        self.assertEqual(len(result), 10)
+        self.assertEqual((result[0], result[-1]), (0., 1.))
+        self.assertTrue(100. in result and -5. in result)
+        self.assertEqual(lttb(values[:5], 10), values[:5])
+        self.assertEqual(lttb(range(10), 1), [0, 1, 9])
+    
+
+class SparkLineTest(TestCase):
+    """Test sparkline views"""
+    def setUp(self):
+        from gmap.views import rate_snapshot
+        Bandwidth.objects.all().delete()
+        store.clear()
+        rate_snapshot.clear()
+        sparkline_cache.clear()
+        for i in range(6):
+            Bandwidth.objects.create(link=1, time=float(i), rx=1000 * i, 
+                tx=2000 * i)
+    
+    def test_xhr_sparkline(self):
+        """Test rx and tx series"""
+        from django.core.urlresolvers import reverse 
+        import json
+        for name, rate in (('xhr_spark_rx', 1.0), ('xhr_spark_tx', 2.0)):
+            r = self.client.get(reverse(name, args=(1, )))
+            rows = json.loads(r.content)['rows']
+            # the first report (no traffic) is not stored
+            self.assertEqual([row['c'][0]['v'] for row in rows], [rate] * 2)
+    
+    def test_sparkline(self):
+        """Test the page shows rx and tx images of the range"""
+        r = self.client.get('/sparkline/1/?limit=2')
+        self.assertTrue('/sparkline/rx/1.svg?limit=2' in r.context['rx_url'])
+        self.assertTrue('/sparkline/tx/1.svg?limit=2' in r.context['tx_url'])
+    
+    def test_image(self):
+        """Test SVG sparklines are rendered once per newest report"""
+        from django.core.urlresolvers import reverse 
+        from gmap import views
+        url = reverse('sparkline_image', kwargs={'direction': 'rx', 
+            'link': 1, 'format': 'svg'})
+        r = self.client.get(url)
+        self.assertEqual(r['Content-Type'], 'image/svg+xml')
+        self.assertTrue('<polyline' in r.content)
+        series = views._spark_series
+        views._spark_series = None # must not be called again
+        try:
+            self.assertEqual(self.client.get(url).content, r.content)
+        finally:
+            views._spark_series = series
+    
+    def test_image_bounds(self):
+        """Test image ranges are bounded before they key the cache"""
+        from django.core.urlresolvers import reverse 
+        from gmap import views
+        url = reverse('sparkline_image', kwargs={'direction': 'tx', 
+            'link': 1, 'format': 'svg'})
+        big = 10 ** 9
+        queries = [({'limit': views.SPARKLINE_LIMIT}, {'limit': big}),
+            ({'points': views.SPARKLINE_LIMIT}, {'points': big}),
+            ({'seconds': 61}, {'seconds': 120}),
+            ({'seconds': views.SPARKLINE_MAX_SECONDS}, {'seconds': big})]
+        for first, second in queries:
+            r = self.client.get(url, first)
+            series = views._spark_series
+            views._spark_series = None # must not be called again
+            try:
+                self.assertEqual(self.client.get(url, second).content, 
+                    r.content)
+            finally:
+                views._spark_series = series
+    
+    def test_uncompacted(self):
+        """Test long ranges use raw reports until they are rolled up"""
+        from django.core.urlresolvers import reverse 
+        import json
+        r = self.client.get(reverse('xhr_spark_rx', args=(1, )), 
+            {'seconds': 86400})
+        self.assertEqual(len(json.loads(r.content)['rows']), 2)
+    
+    def test_range(self):
+        """Test ranges must be positive integers"""
+        from django.core.urlresolvers import reverse 
+        url = reverse('xhr_spark_rx', args=(1, ))
+        for query in ({'limit': -5}, {'limit': 0}, {'seconds': 0}, 
+                {'seconds': 'x'}):
+            self.assertEqual(self.client.get(url, query).status_code, 404)
+    
+    def test_points(self):
+        """Test sparklines are downsampled to ?points="""
+        from django.core.urlresolvers import reverse 
+        import json
+        Bandwidth.objects.add_reports([(1, float(i), 1000 * i, 2000 * i) 
+            for i in range(6, 30)])
+        r = self.client.get(reverse('xhr_spark_tx', args=(1, )), 
+            {'points': 5})
+        self.assertEqual(len(json.loads(r.content)['rows']), 5)
+        for points in ('0', '-1', 'x'):
+            r = self.client.get(reverse('xhr_spark_many', args=(1, )), 
+                {'points': points})
+            self.assertEqual(r.status_code, 404, points)
+    
+    def test_downsample(self):
+        """Test rx and tx are downsampled to the same windows"""
+        from gmap.views import _spark_downsample
+        rx = [0.] * 20 + [100.] + [0.] * 79
+        tx = [0.] * 60 + [50.] + [1.] * 39
+        result = _spark_downsample((rx, tx), 10)
+        self.assertEqual(len(result[0]), 10)
+        self.assertEqual(len(result[1]), 10)
+        pairs = zip(*result)
+        self.assertTrue((100., 0.) in pairs and (0., 50.) in pairs)
+        self.assertTrue(set(pairs) <= set(zip(rx, tx)))
+    
+    def test_after(self):
+        """Test only the rates of reports after ?after= are returned"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        url = reverse('xhr_spark_rx', args=(1, ))
+        data = json.loads(self.client.get(url, {'after': 0}).content)
+        self.assertEqual(len(data['table']['rows']), 2)
+        seq = data['seq']
+        self.assertEqual(seq, Bandwidth.objects.last_seq())
+        data = json.loads(self.client.get(url, {'after': seq}).content)
+        self.assertEqual((data['seq'], data['table']['rows']), (seq, []))
+        Bandwidth.objects.create(link=1, time=6., rx=6000, tx=12000)
+        # new reports are read once the rate snapshot has them
+        rate_snapshot.clear()
+        url = reverse('xhr_spark_many', args=(1, ))
+        data = json.loads(self.client.get(url, {'after': seq}).content)
+        self.assertEqual(data['seq'], Bandwidth.objects.last_seq())
+        self.assertEqual([[c['v'] for c in row['c']] 
+            for row in data['links']['1']['rows']], [[1.0, 2.0]])
+    
+
+class SparkLineCacheTest(TestCase):
+    """Test the sparkline cache"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        self.cache = SparkLineCache(size=5)
+        self._add(0, 8)
+    
+    def _add(self, start, end):
+        Bandwidth.objects.add_reports([(1, float(i), 1000 * i * i, 10 * i) 
+            for i in range(start, end)])
+    
+    def _check(self, **kwargs):
+        self.assertEqual(self.cache.rates(1, **kwargs), 
+            Bandwidth.objects.window_rates(1, **kwargs))
+    
+    def test_extend(self):
+        """Test rates are extended with new reports only"""
+        self._check(limit=5)
+        self._add(8, 10)
+        # one query for the two new reports
+        self.assertNumQueries(1, self.cache.rates, 1, limit=5)
+        self._check(limit=5)
+        self._check(limit=2)
+        self._check(seconds=60)
+    
+    def test_seq(self):
+        """Test no query is made for links cached up to seq"""
+        self.cache.rates(1)
+        seq = Bandwidth.objects.last_seq()
+        self.assertNumQueries(0, self.cache.rates, 1, limit=5, seq=seq)
+    
+    def test_batch_seq(self):
+        """Test links fed by batches are cached up to their own seq"""
+        from gmap.models import LatestBandwidth
+        Bandwidth.objects.add_reports([(2, 1., 1000, 1000)])
+        self.cache.rates(1)
+        seqs = dict([(link, seq) 
+            for link, samples, seq in LatestBandwidth.objects.samples()])
+        self.assertNumQueries(0, self.cache.rates, 1, limit=5, seq=seqs[1])
+    
+    def test_late_commit(self):
+        """Test reports committed out of id order are not skipped"""
+        from datetime import timedelta
+        self._add(8, 10)
+        self.cache.rates(1)
+        date = Bandwidth.objects.filter(link=1).latest('id').update_date
+        # a report of a transaction that started before the newest one
+        late = Bandwidth.objects.create(link=1, time=7.5, rx=60000, tx=75)
+        Bandwidth.objects.filter(pk=late.pk).update(
+            update_date=date - timedelta(microseconds=1))
+        self._check(limit=5)
+        self._check(seconds=60)
+        # only the rate of the window that ends with the late report
+        after = Bandwidth.objects.filter(link=1, time=9.).get().pk
+        rx, tx, seq = self.cache.rates_after(1, after)
+        self.assertEqual((len(rx), len(tx)), (1, 1))
+    
+    def test_uncached(self):
+        """Test ranges larger than the cache are read from the database"""
+        self._check(limit=20)
+        self._add(8, 20)
+        self._check(seconds=60)
+        self._check(limit=3)
+    
+    def test_delete(self):
+        """Test deleted reports drop the link from the cache"""
+        sparkline_cache.clear()
+        sparkline_cache.rates(1)
+        Bandwidth.objects.filter(time__gte=4).delete()
+        self.assertEqual(sparkline_cache.rates(1), 
+            Bandwidth.objects.window_rates(1))
+    
+
+class SparkLineManyTest(TestCase):
+    """Test sparklines of many links"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        for link in (1, 2):
+            for i in range(6):
+                Bandwidth.objects.create(link=link, time=float(i), 
+                    rx=1000 * i * link, tx=2000 * i * link)
+    
+    def test_window_rates_many(self):
+        """Test rates of many links from one query"""
+        rates = Bandwidth.objects.window_rates_many([1, 2, 3], seconds=600)
+        self.assertNumQueries(1, Bandwidth.objects.window_rates_many, 
+            [1, 2, 3], seconds=600)
+        self.assertEqual(sorted(rates), [1, 2])
+        for link in (1, 2):
+            self.assertEqual(rates[link], 
+                Bandwidth.objects.window_rates(link, seconds=600))
+        rates = Bandwidth.objects.window_rates_many(limit=1)
+        self.assertEqual(rates[2], ([2000.0], [4000.0]))
+    
+    def test_thread_pool(self):
+        """Test rates computed by a thread pool"""
+        from gmap import views
+        threshold = views.SPARKLINE_POOL_THRESHOLD
+        views.SPARKLINE_POOL_THRESHOLD = 0
+        try:
+            rates = Bandwidth.objects.window_rates_many(map=views._spark_map)
+        finally:
+            views.SPARKLINE_POOL_THRESHOLD = threshold
+        self.assertEqual(rates, Bandwidth.objects.window_rates_many())
+    
+    def test_xhr_spark_many(self):
+        """Test rx and tx tables of many links in one response"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        rate_snapshot.clear()
+        r = self.client.get(reverse('xhr_spark_many', args=('all', )))
+        tables = json.loads(r.content)
+        self.assertEqual(sorted(tables), ['1', '2'])
+        self.assertEqual([c['id'] for c in tables['2']['cols']], ['rx', 'tx'])
+        self.assertEqual([[c['v'] for c in row['c']] 
+            for row in tables['2']['rows']], [[2.0, 4.0]] * 2)
+        self.assertTrue(r.has_header('ETag'))
+        r = self.client.get(reverse('xhr_spark_many', args=('1+3', )))
+        tables = json.loads(r.content)
+        self.assertEqual(sorted(tables), ['1', '3'])
+        self.assertEqual(tables['3']['rows'], [])
+    
+
+class LatestBandwidthTest(TestCase):
+    """Test the latest samples table"""
+    def setUp(self):
+        from gmap.models import LatestBandwidth
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.add_reports([(1, 1., 1, 1), (1, 2., 2, 2), 
+            (2, 1., 1, 1), (2, 3., 3, 5)])
+        self.latest = LatestBandwidth.objects
+    
+    def _samples(self):
+        return sorted([(link, samples) 
+            for link, samples, seq in self.latest.samples()])
+    
+    def test_rebuild_command(self):
+        """Test the command fills the table of an existing database"""
+        from django.core.management import call_command
+        samples = self._samples()
+        self.latest.all().delete()
+        call_command('rebuild_latest')
+        self.assertEqual(self._samples(), samples)
+    
+    def test_seq(self):
+        """Test each link carries the id of its own newest report"""
+        seqs = dict([(link, seq) for link, samples, seq in self.latest.samples()])
+        self.assertEqual(seqs, {1: Bandwidth.objects.last_seq(1),
+            2: Bandwidth.objects.last_seq(2)})
+        self.assertTrue(seqs[1] < seqs[2])
+        self.latest.all().delete()
+        self.latest.rebuild(1)
+        self.assertEqual([seq for link, samples, seq in self.latest.samples()],
+            [seqs[1]])
+    
+    def test_delete(self):
+        """Test deleting reports rebuilds each link once"""
+        rebuilt = []
+        rebuild = self.latest.rebuild
+        self.latest.rebuild = lambda link, *args: rebuilt.append(link)
+        try:
+            Bandwidth.objects.all().delete()
+        finally:
+            self.latest.rebuild = rebuild
+        self.assertEqual(sorted(rebuilt), [1, 2])
+    
+    def test_push_race(self):
+        """Test a push retries the update if a concurrent push added the 
+        link first"""
+        from django.db import IntegrityError
+        update, rebuild = self.latest._update, self.latest.rebuild
+        def rebuild_race(*args, **kwargs):
+            raise IntegrityError
+        self.latest.rebuild = rebuild_race
+        def update_once(*args):
+            self.latest._update = update
+            return 0
+        self.latest._update = update_once
+        try:
+            self.latest.push(1, [Sample(4., 8, 8)], 100)
+        finally:
+            self.latest._update, self.latest.rebuild = update, rebuild
+        self.assertEqual(dict(self._samples())[1], 
+            (Sample(4., 8, 8), Sample(2., 2, 2)))
+    
+
+class BandwidthAllTest(TestCase):
+    """Test rates of all links"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.create(link=1, time=1., rx=1, tx=1)
+        Bandwidth.objects.create(link=2, time=1., rx=1, tx=1)
+        Bandwidth.objects.create(link=2, time=2., rx=2, tx=2)
+        Bandwidth.objects.add_reports([(3, 1., 2, 10), (3, 3., 4, 20)])
+        store.clear()
+    
+    def test_xhr_all(self):
+        """Test xhr_bw with all links"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        rate_snapshot.clear()
+        r = self.client.get(reverse('xhr_bw', args=('all', )))
+        self.assertEqual([d['id'] for d in json.loads(r.content)], 
+                ['1', '2', '3'])
+    
+
+class RateSnapshotTest(TestCase):
+    """Test rates snapshot"""
+    def setUp(self):
+        from gmap.snapshot import RateSnapshot
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.create(link=1, time=1., rx=1000, tx=1000)
+        Bandwidth.objects.create(link=1, time=2., rx=3000, tx=4000)
+        self.snapshot = RateSnapshot(3600)
+    
+    def test_shared(self):
+        """Test the snapshot is computed once per interval"""
+        snapshot = self.snapshot.get()
+        self.assertEqual(snapshot.data, [{'id':'1', 'rx':2.0, 'tx':3.0}])
+        self.assertNumQueries(0, self.snapshot.get)
+        self.assertTrue(self.snapshot.get() is snapshot)
+    
+    def test_select(self):
+        """Test link subsets"""
+        snapshot = self.snapshot.get()
+        self.assertEqual(snapshot.select(['2', '1']), 
+                [{'id':'2', 'rx':0.0, 'tx':0.0}, {'id':'1', 'rx':2.0, 'tx':3.0}])
+    
+
+class BandwidthStreamTest(TestCase):
+    """Test server-sent events"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.create(link=1, time=1., rx=1000, tx=1000)
+        Bandwidth.objects.create(link=1, time=2., rx=3000, tx=4000)
+    
+    def test_events(self):
+        """Test the rates of all links are pushed"""
+        import json
+        from gmap.views import _bw_events, _Stream, _streams, rate_snapshot
+        rate_snapshot.clear()
+        stream = _Stream.open(_bw_events(60))
+        self.assertEqual(_streams[0], 1)
+        events = iter(stream)
+        self.assertTrue(events.next().startswith('retry: '))
+        event = events.next()
+        self.assertTrue(event.startswith('data: ') and event.endswith('\n\n'))
+        self.assertEqual(json.loads(event[6:]), {'id':'1', 'rx':2.0, 'tx':3.0})
+        stream.close()
+        stream.close()
+        self.assertEqual(_streams[0], 0)
+    
+    def test_stream_max(self):
+        """Test slots are taken before the events run"""
+        from django.core.urlresolvers import reverse 
+        from gmap import views
+        streams = views.BW_STREAM_MAX
+        views.BW_STREAM_MAX = 2
+        try:
+            responses = [self.client.get(reverse('xhr_bw_stream')) 
+                for i in range(3)]
+            self.assertEqual([r.status_code for r in responses], 
+                [200, 200, 503])
+            self.assertEqual(views._streams[0], 2)
+            for r in responses:
+                r.close()
+            self.assertEqual(views._streams[0], 0)
+        finally:
+            views.BW_STREAM_MAX = streams
+    
+
+class BandwidthDeltaTest(TestCase):
+    """Test xhr_bw changes since a sequence number"""
+    def setUp(self):
+        from gmap.snapshot import RateSnapshot
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.add_reports([(1, 1., 1000, 1000), (1, 2., 2000, 2000),
+                (2, 1., 1000, 1000), (2, 2., 2000, 2000)])
+        self.snapshot = RateSnapshot(3600)
+    
+    def test_delta(self):
+        """Test only links with changed rates are returned"""
+        first = self.snapshot.get()
+        self.assertEqual(first.seq, Bandwidth.objects.last_seq())
+        self.assertEqual(len(first.delta(0)), 2)
+        Bandwidth.objects.create(link=1, time=3., rx=4000, tx=2000)
+        Bandwidth.objects.create(link=2, time=3., rx=3000, tx=3000)
+        self.snapshot._snapshot = first
+        self.snapshot._snapshot.bucket = -1 # expired
+        second = self.snapshot.get()
+        self.assertTrue(second.seq > first.seq)
+        # link 2 has the same rates
+        self.assertEqual(second.delta(first.seq), 
+                [{'id':'1', 'rx':2.0, 'tx':0.0}])
+    
+    def test_xhr_since(self):
+        """Test xhr_bw with since"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        rate_snapshot.clear()
+        url = reverse('xhr_bw', args=('all', ))
+        data = json.loads(self.client.get(url, {'since': 0}).content)
+        self.assertEqual([d['id'] for d in data['links']], ['1', '2'])
+        data = json.loads(self.client.get(url, {'since': data['seq']}).content)
+        self.assertEqual(data['links'], [])
+    
+    def test_late_commit(self):
+        """Test a change committed below an advertised sequence number is 
+        numbered after it"""
+        from gmap.models import LatestBandwidth
+        first = self.snapshot.get()
+        # a report of link 2 with a lower id than link 1's newest report
+        LatestBandwidth.objects.push(2, [Sample(3., 5000, 5000)], 1)
+        self.snapshot._snapshot.bucket = -1 # expired
+        second = self.snapshot.get()
+        self.assertEqual(second.changed[2], first.seq + 1)
+        self.assertEqual(second.delta(first.seq), 
+                [{'id':'2', 'rx':3.0, 'tx':3.0}])
+        self.assertEqual(second.delta(second.seq), [])
+    
+    def test_compact(self):
+        """Test xhr_bw with the compact (v2) payload"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        rate_snapshot.clear()
+        url = reverse('xhr_bw', args=('all', ))
+        data = json.loads(self.client.get(url, {'v': 2}).content)
+        self.assertEqual((data['v'], data['ids'], data['rx'], data['tx']),
+            (2, [1, 2], [1.0, 1.0], [1.0, 1.0]))
+        self.assertEqual(data['seq'], Bandwidth.objects.last_seq())
+        self.assertTrue(data['ts'] > 0)
+        data = json.loads(self.client.get(reverse('xhr_bw', args=('2', )), 
+            {'v': 2}).content)
+        self.assertEqual(data['ids'], [2])
+        data = json.loads(self.client.get(url, 
+            {'v': 2, 'since': data['seq']}).content)
+        self.assertEqual((data['ids'], data['rx'], data['tx']), ([], [], []))
+        self.assertEqual(self.client.get(url, {'v': 3}).status_code, 404)
+    
+    def test_link_list(self):
+        """Test xhr_bw ignores empty ids in link lists"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        import json
+        rate_snapshot.clear()
+        url = reverse('xhr_bw', args=('1++2', ))
+        data = json.loads(self.client.get(url).content)
+        self.assertEqual([d['id'] for d in data], ['1', '2'])
+        data = json.loads(self.client.get(url, {'v': 2}).content)
+        self.assertEqual(data['ids'], [1, 2])
+        data = json.loads(self.client.get(url, {'since': 0}).content)
+        self.assertEqual([d['id'] for d in data['links']], ['1', '2'])
+        url = reverse('xhr_bw', args=('+', ))
+        self.assertEqual(json.loads(self.client.get(url).content), [])
+        data = json.loads(self.client.get(url, {'v': 2}).content)
+        self.assertEqual(data['ids'], [])
+        data = json.loads(self.client.get(url, {'since': 0}).content)
+        self.assertEqual(data['links'], [])
+    
+
+class ConditionalGetTest(TestCase):
+    """Test ETag and Last-Modified validators"""
+    def setUp(self):
+        from gmap.views import rate_snapshot
+        Bandwidth.objects.all().delete()
+        store.clear()
+        rate_snapshot.clear()
+        sparkline_cache.clear()
+        Bandwidth.objects.add_reports([(1, 1., 1000, 1000), (1, 2., 2000, 2000)])
+    
+    def _not_modified(self, url, data={}):
+        r = self.client.get(url, data)
+        self.assertEqual(r.status_code, 200)
+        self.assertTrue('max-age' in r['Cache-Control'])
+        r = self.client.get(url, data, HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+        return r
+    
+    def test_xhr_bw(self):
+        """Test xhr_bw answers 304 until the rates change"""
+        from django.core.urlresolvers import reverse 
+        from gmap.views import rate_snapshot
+        url = reverse('xhr_bw', args=('all', ))
+        etag = self.client.get(url)['ETag']
+        self._not_modified(url)
+        self._not_modified(reverse('xhr_bw', args=('1+2', )))
+        self._not_modified(url, {'since': 0})
+        Bandwidth.objects.create(link=1, time=3., rx=4000, tx=2000)
+        rate_snapshot.clear()
+        r = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
+    
+    def test_sparkline(self):
+        """Test sparkline views answer 304"""
+        from django.core.urlresolvers import reverse 
+        self._not_modified(reverse('xhr_spark_rx', args=(1, )))
+        self._not_modified(reverse('xhr_spark_tx', args=(1, )), {'seconds': 60})
+        self._not_modified('/sparkline/1/')
+    
+    def test_json(self):
+        """Test json files answer 304 if not modified"""
+        r = self.client.get('/json/ec2regions/')
+        self.assertEqual(r.status_code, 200)
+        r = self.client.get('/json/ec2regions/',
+                HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+        self.assertEqual(r.status_code, 304)
+    
+
+class TopologyStoreTest(TestCase):
+    """Test the in-memory store of json files"""
+    def setUp(self):
+        import tempfile
+        from gmap.topology import TopologyStore
+        self.dir = tempfile.mkdtemp()
+        self.store = TopologyStore(self.dir, check_interval=0)
+    
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+    
+    def _write(self, data, mtime):
+        import os
+        path = os.path.join(self.dir, 'links.json')
+        open(path, 'w').write(data)
+        os.utime(path, (mtime, mtime))
+    
+    def test_reload(self):
+        """Test changed files are reloaded and invalid ones ignored"""
+        import gzip
+        from cStringIO import StringIO
+        self.assertEqual(self.store.get('links'), None)
+        self._write('[1]', 1000)
+        f = self.store.get('links')
+        self.assertEqual(f.obj, [1])
+        self.assertEqual(gzip.GzipFile(fileobj=StringIO(f.gzipped)).read(), 
+                '[1]')
+        self._write('[2]', 2000)
+        self.assertEqual(self.store.get('links').obj, [2])
+        self._write('[3', 3000)
+        self.assertEqual(self.store.get('links').obj, [2])
+    
+    def test_json_gzip(self):
+        """Test json files are gzipped if accepted"""
+        r = self.client.get('/json/links/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(r['Content-Encoding'], 'gzip')
+        self.assertTrue('Accept-Encoding' in r['Vary'])
+        r = self.client.get('/json/links/')
+        self.assertFalse(r.has_header('Content-Encoding'))
+        for accept in ('gzip;q=0', 'deflate, gzip; q=0.0', '*;q=0', 'gzip2'):
+            r = self.client.get('/json/links/', HTTP_ACCEPT_ENCODING=accept)
+            self.assertFalse(r.has_header('Content-Encoding'), accept)
+        for accept in ('deflate, GZIP;q=0.5', '*', 'br;q=1, *;q=0.1'):
+            r = self.client.get('/json/links/', HTTP_ACCEPT_ENCODING=accept)
+            self.assertEqual(r['Content-Encoding'], 'gzip', accept)
+        self.assertEqual(self.client.get('/json/nosuchfile/').status_code, 404)
+    
+    def test_json_not_modified(self):
+        """Test 304 responses vary on Accept-Encoding"""
+        r = self.client.get('/json/links/')
+        r = self.client.get('/json/links/', 
+            HTTP_IF_MODIFIED_SINCE=r['Last-Modified'])
+        self.assertEqual(r.status_code, 304)
+        self.assertTrue('Accept-Encoding' in r['Vary'])
+    
+
+class MapBootstrapTest(TestCase):
+    """Test the topology and rates to draw the map"""
+    def setUp(self):
+        from gmap.views import rate_snapshot
+        Bandwidth.objects.all().delete()
+        store.clear()
+        rate_snapshot.clear()
+        Bandwidth.objects.add_reports([(1, 1., 1000, 1000), (1, 2., 2000, 2000)])
+    
+    def test_xhr_map(self):
+        """Test links carry coordinates and rates are included"""
+        from django.core.urlresolvers import reverse 
+        import json
+        r = self.client.get(reverse('xhr_map'))
+        data = json.loads(r.content)
+        link = data['links'][0]
+        start = data['geocode'][link['start']]['position']
+        end = data['geocode'][link['end']]['position']
+        self.assertEqual(link['path'], [[start[0] + .1, start[1]], 
+                [end[0] + .1, end[1]]])
+        self.assertEqual(link['center'], [(start[0] + end[0]) / 2, 
+                (start[1] + end[1]) / 2])
+        self.assertEqual(data['rates'], [{'id':'1', 'rx':1.0, 'tx':1.0}])
+        self.assertEqual(data['seq'], Bandwidth.objects.last_seq())
+        r = self.client.get(reverse('xhr_map'), HTTP_IF_NONE_MATCH=r['ETag'])
+        self.assertEqual(r.status_code, 304)
+    
+
+class HistoryTest(TestCase):
+    """Test streaming the history of a link"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.add_reports([(1, float(i), 1000 * i, 2000 * i) 
+            for i in range(1, 6)] + [(2, 1., 1000, 1000)])
+    
+    def test_pages(self):
+        """Test pages are joined into one table"""
+        from django.core.urlresolvers import reverse 
+        from gmap import views
+        from gmap.utils import gviz_api
+        url = reverse('history', args=(1, ))
+        old, views.HISTORY_PAGE_SIZE = views.HISTORY_PAGE_SIZE, 2
+        try:
+            # three pages and the end, read as the response is sent
+            with self.assertNumQueries(4):
+                r = self.client.get(url, {'tqx': 'out:csv'})
+                content = r.content
+        finally:
+            views.HISTORY_PAGE_SIZE = old
+        table = gviz_api.DataTable(views.HISTORY_DESCRIPTION)
+        table.LoadData(Bandwidth.objects.filter(link=1).order_by('id')
+            .values_list('update_date', 'time', 'rx', 'tx'))
+        self.assertEqual(content, table.ToCsv())
+        self.assertEqual(r['Content-Type'], 'text/csv; charset=utf-8')
+        r = self.client.get(url)
+        self.assertEqual(r.content, table.ToJSonResponse())
+    
+    def test_invalid(self):
+        """Test unsupported formats"""
+        from django.core.urlresolvers import reverse 
+        r = self.client.get(reverse('history', args=(1, )), {'tqx': 'out:xml'})
+        self.assertEqual(r.status_code, 400)
+    
+
+class DataSourceTest(TestCase):
+    """Test Google Visualization queries"""
+    def setUp(self):
+        Bandwidth.objects.all().delete()
+        store.clear()
+        Bandwidth.objects.add_reports([(1, float(t), 1000 * t, 2000 * t)
+            for t in range(1, 10)] + [(2, 5., 1000, 1000)])
+    
+    def _query(self, tq):
+        from gmap.datasource import Query
+        return Query(tq).rows()
+    
+    def test_select(self):
+        """Test columns, conditions and limits"""
+        self.assertEqual(self._query('select time, rx where link = 1 and '
+                'time >= 3 and time < 6 limit 2 offset 1'), 
+                [[4.0, 4000], [5.0, 5000]])
+        self.assertEqual(self._query('select link where time = 5 and rx <> 1000'),
+                [[1]])
+        self.assertEqual(len(self._query('')), 10)
+    
+    def test_group(self):
+        """Test time buckets and aggregates run in SQL"""
+        with self.assertNumQueries(1):
+            rows = self._query('select bucket(time, 4), max(rx), count(tx) '
+                'where link = 1 group by bucket(time, 4)')
+        self.assertEqual(rows, [[0, 3000, 3], [4, 7000, 4], [8, 9000, 2]])
+        self.assertEqual(self._query('where link = 1 group by bucket(time, 4) '
+                'limit 1'), [[0, 2000., 4000.]])
+        self.assertEqual(self._query('select sum(rx) where link = 2'), 
+                [[1000]])
+    
+    def test_invalid(self):
+        """Test unsupported queries"""
+        from gmap.datasource import Query, QueryError
+        for tq in ('select foo', 'select rx group by bucket(time, 4)', 
+                'select bucket(time, 5) group by bucket(time, 4)',
+                'select rx, max(tx)', 'where time like 5', 'limit 1.5',
+                'select rx;', 'select sum(update_date)', 
+                'select avg(update_date)'):
+            self.assertRaises(QueryError, Query, tq)
+    
+    def test_view(self):
+        """Test gviz responses"""
+        from django.core.urlresolvers import reverse 
+        import json
+        url = reverse('datasource')
+        r = self.client.get(url, {'tq': 'select max(rx) where link = 1', 
+            'tqx': 'reqId:7'})
+        self.assertTrue(r.content.startswith(
+            'google.visualization.Query.setResponse('))
+        data = json.loads(r.content[39:-2])
+        self.assertEqual(data['reqId'], '7')
+        self.assertEqual(data['table']['rows'], [{'c': [{'v': 9000}]}])
+        r = self.client.get(url, {'tq': 'select foo', 'tqx': 'reqId:7'})
+        data = json.loads(r.content[39:-2])
+        self.assertEqual(data['status'], 'error')
+        r = self.client.get(url, {'tq': 'select foo', 'tqx': 'out:csv'})
+        self.assertEqual(r.status_code, 400)
+        r = self.client.get(url, {'tq': 'select rx where link = 2', 
+            'tqx': 'out:csv'})
+        self.assertEqual(r.content, 'rx\r\n1000\r\n')
+        for tqx in ('version:0.5', 'reqId:1:2', 'out', 'out:csv;'):
+            r = self.client.get(url, {'tq': 'select rx', 'tqx': tqx})
+            self.assertEqual(r.status_code, 400, tqx)
+    
+    def test_datetime_aggregates(self):
+        """Test min and max of update_date are datetimes"""
+        from django.core.urlresolvers import reverse 
+        import json
+        r = self.client.get(reverse('datasource'), 
+            {'tq': 'select min(update_date), max(update_date), '
+                'count(update_date)'})
+        self.assertEqual(r.status_code, 200)
+        data = json.loads(r.content[39:-2])
+        self.assertEqual([c['type'] for c in data['table']['cols']],
+            ['datetime', 'datetime', 'number'])
+        self.assertEqual(data['table']['rows'][0]['c'][2], {'v': 10})
+    
@@ -0,0 +1,138 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# All rights reserved
+
+"""gviz_api tests"""
+import datetime
+import json
+from django.test import TestCase
+from gmap.utils.gviz_api import DataTable, DataTableException
+
+class ColumnarDataTableTest(TestCase):
+    """Test columnar tables encode like row tables"""
+    tables = [
+        ([('a', 'number'), ('b', 'string'), ('c', 'boolean'), ('d', 'date'),
+          ('e', 'datetime', 'E', {'x': 'y'})],
+         [[1, 'z', True, datetime.date(2012, 1, 2), 
+           datetime.datetime(2012, 1, 2, 3, 4, 5)],
+          [(3, '3$'), u'w\xe9', 0, None, None],
+          [None, 'a,b'],
+          [2.5, (None, 'n', {'p': 1}), 1, datetime.datetime(2012, 5, 1)]]),
+        ({'a': 'number', 'b': ('string', 'B')},
+         [{'a': 1, 'b': 'x'}, {'a': 2}, {'b': 'y'}]),
+        ('a', ['x', 'y', 'z']),
+    ]
+
+    def _tables(self, description, data, custom_properties=None):
+        rows = DataTable(description, custom_properties=custom_properties)
+        rows.LoadData(data)
+        columns = DataTable(description, custom_properties=custom_properties,
+                columnar=True)
+        columns.LoadData(data)
+        return rows, columns
+
+    def test_same_output(self):
+        """Test all output formats match"""
+        for description, data in self.tables:
+            for cp in (None, {'foo': 'bar'}):
+                rows, columns = self._tables(description, data, cp)
+                rows.SetRowsCustomProperties(0, {'r': '1'})
+                columns.SetRowsCustomProperties(0, {'r': '1'})
+                for order_by in ((), 'a', [('a', 'desc')], ('b', 'asc')):
+                    for method in ('ToJSon', 'ToJSonResponse', 'ToCsv', 
+                            'ToHtml'):
+                        self.assertEqual(
+                            getattr(rows, method)(order_by=order_by),
+                            getattr(columns, method)(order_by=order_by))
+                self.assertEqual(rows.ToJSCode('t'), columns.ToJSCode('t'))
+                self.assertEqual(rows.NumberOfRows(), columns.NumberOfRows())
+
+    def test_append_columns(self):
+        """Test rows given as columns"""
+        description = [('rx', 'number'), ('tx', 'number')]
+        rows, columns = self._tables(description, [[1, 3], [2, 4], [None, 5]])
+        columns.LoadData([])
+        columns.AppendColumns({'rx': [1, 2], 'tx': [3, 4]})
+        columns.AppendColumns({'tx': [5]})
+        self.assertEqual(rows.ToJSon(), columns.ToJSon())
+        self.assertRaises(DataTableException, columns.AppendColumns, 
+                {'rx': [1], 'tx': []})
+        self.assertRaises(DataTableException, columns.AppendColumns, 
+                {'foo': [1]})
+        self.assertRaises(DataTableException, rows.AppendColumns, {'rx': [1]})
+
+    def test_errors(self):
+        """Test bad data raises as for row tables"""
+        rows, columns = self._tables([('a', 'number')], [['x']])
+        self.assertRaises(DataTableException, rows.ToJSon)
+        self.assertRaises(DataTableException, columns.ToJSon)
+        self.assertRaises(DataTableException, columns.AppendData, [[1, 2]])
+        self.assertRaises(DataTableException, DataTable, 
+                {('a', 'number'): [('b', 'number')]}, columnar=True)
+    
+
+class IterDataTableTest(TestCase):
+    """Test chunked output matches the whole output"""
+    description = [('a', 'number'), ('b', 'string')]
+    data = [[i, u'x\xe9,"%d' % i] for i in range(250)]
+    formats = ('JSon', 'JSonResponse', 'Csv', 'Html', 'TsvExcel')
+
+    def test_chunks(self):
+        """Test joined chunks"""
+        for columnar in (False, True):
+            table = DataTable(self.description, self.data, {'k': 'v'},
+                    columnar=columnar)
+            for f in self.formats:
+                chunks = list(getattr(table, 'Iter' + f)(order_by='a'))
+                self.assertTrue(len(chunks) > 2)
+                self.assertEqual(''.join(chunks), 
+                        getattr(table, 'To' + f)(order_by='a'))
+
+    def test_pages(self):
+        """Test pages are written as one table"""
+        pages = [self.data[:100], self.data[100:101], [], self.data[101:]]
+        for columnar in (False, True):
+            table = DataTable(self.description, self.data, columnar=columnar)
+            for f in self.formats:
+                paged = DataTable(self.description, columnar=columnar)
+                self.assertEqual(
+                        ''.join(getattr(paged, 'Iter' + f)(pages=pages)),
+                        getattr(table, 'To' + f)())
+        self.assertRaises(DataTableException, table.IterResponse, 
+                tqx='out:xml')
+    
+
+class DataTableSortTest(TestCase):
+    """Test order_by"""
+    description = [('a', 'number'), ('b', 'string'), ('i', 'number')]
+    data = [[2, 'x', 0], [None, 'y', 1], [1, 'x', 2], [2, None, 3], 
+            [None, 'x', 4], [1, 'y', 5], [2, 'x', 6]]
+
+    def _order(self, order_by):
+        orders = []
+        for columnar in (False, True):
+            table = DataTable(self.description, self.data, columnar=columnar)
+            orders.append([row['i'] for row, cp in 
+                table._PreparedData(order_by)])
+            data = json.loads(table.ToJSon(order_by=order_by))
+            orders.append([row['c'][2]['v'] for row in data['rows']])
+        for order in orders[1:]:
+            self.assertEqual(order, orders[0])
+        return orders[0]
+
+    def test_none(self):
+        """Test None sorts first ascending and last descending"""
+        self.assertEqual(self._order('a'), [1, 4, 2, 5, 0, 3, 6])
+        self.assertEqual(self._order(('a', 'desc')), [0, 3, 6, 2, 5, 1, 4])
+        self.assertEqual(self._order('b'), [3, 0, 2, 4, 6, 1, 5])
+
+    def test_mixed(self):
+        """Test mixed directions and stability"""
+        self.assertEqual(self._order([('a', 'asc'), ('b', 'desc')]),
+                [1, 4, 5, 2, 0, 6, 3])
+        self.assertEqual(self._order([('b', 'desc'), ('a', 'desc')]),
+                [5, 1, 0, 6, 2, 4, 3])
+        self.assertEqual(self._order([('a', 'desc'), ('b', 'asc'), 
+                ('i', 'desc')]), [3, 6, 0, 2, 5, 4, 1])
+        # unknown columns compare equal
+        self.assertEqual(self._order([('z', 'desc'), 'a']), self._order('a'))
+    
@@ -0,0 +1,153 @@
+# Copyright (c) 2012 Shakir James and Washington University in St. Louis.
+# See LICENSE for details.
+
+"""In-memory store of the topology json files (gmap/json/<name>.json).
+
+Each file is read once per process, validated, and kept as raw and gzipped
+bytes, so views.json serves it without filesystem I/O. A file's mtime is
+checked at most every GMAP_JSON_CHECK_INTERVAL seconds and changed files are
+reloaded. A file that fails to parse keeps its previous version.
+"""
+import gzip
+import json
+import logging
+import os
+import threading
+import time
+from cStringIO import StringIO
+from datetime import datetime
+from django.conf import settings
+
+JSON_DIR = os.path.join(settings.SITE_ROOT, 'gmap', 'json')
+JSON_CHECK_INTERVAL = getattr(settings, 'GMAP_JSON_CHECK_INTERVAL', 5) # s
+
+logger = logging.getLogger(__name__)
+
+
+def _gzip(data):
+    buf = StringIO()
+    f = gzip.GzipFile(mode='wb', compresslevel=9, fileobj=buf)
+    f.write(data)
+    f.close()
+    return buf.getvalue()
+
+
+class TopologyFile(object):
+    """Content of a json file"""
+
+    def __init__(self, data, mtime):
+        """
+        Args:
+            data: file content (a JSON document)
+            mtime: modification time of the file (s since the epoch)
+        """
+        self.obj = json.loads(data)
+        self.data = data
+        self.gzipped = _gzip(data)
+        self.mtime = mtime
+        self.last_modified = datetime.fromtimestamp(mtime)
+        self.checked = time.time()
+
+
+class TopologyStore(object):
+    """Json files of a directory, reloaded when they change"""
+
+    def __init__(self, directory=JSON_DIR, check_interval=JSON_CHECK_INTERVAL):
+        """
+        Args:
+            directory: directory of the json files
+            check_interval: check file mtimes at most every check_interval s
+        """
+        self.directory = directory
+        self.check_interval = check_interval
+        self._files = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.json')
+
+    def _load(self, name, old):
+        """Return the current TopologyFile of name (old if unchanged)."""
+        path = self._path(name)
+        try:
+            mtime = os.path.getmtime(path)
+            if old is not None and old.mtime == mtime:
+                old.checked = time.time()
+                return old
+            return TopologyFile(open(path, 'rb').read(), mtime)
+        except (IOError, OSError):
+            return None
+        except ValueError:
+            logger.exception('invalid json file %s', path)
+            if old is not None:
+                old.checked = time.time()
+            return old
+
+    def get(self, name):
+        """Return the TopologyFile of name, or None if there is no file."""
+        f = self._files.get(name)
+        if f is None or time.time() - f.checked >= self.check_interval:
+            with self._lock:
+                f = self._files.get(name)
+                if f is None or time.time() - f.checked >= self.check_interval:
+                    f = self._load(name, f)
+                    if f is None:
+                        self._files.pop(name, None)
+                    else:
+                        self._files[name] = f
+        return f
+
+    def preload(self):
+        """Load all json files of the directory."""
+        for filename in os.listdir(self.directory):
+            name, ext = os.path.splitext(filename)
+            if ext == '.json':
+                self.get(name)
+
+    def clear(self):
+        self._files.clear()
+
+
+topology = TopologyStore()
+
+
+class MapTopology(object):
+    """Routers and links of the map, with the coordinates of each link"""
+
+    def __init__(self, store=topology):
+        self.store = store
+        self._files = None
+        self._data = None
+
+    def _build(self, geocode, routers, links):
+        data = []
+        for link in links:
+            start = geocode[link['start']]['position']
+            end = geocode[link['end']]['position']
+            d = dict(link)
+            # links are drawn a little north of the router markers
+            d['path'] = [[start[0] + .1, start[1]], [end[0] + .1, end[1]]]
+            d['center'] = [(start[0] + end[0]) / 2, (start[1] + end[1]) / 2]
+            data.append(d)
+        return {'geocode': geocode, 'routers': routers, 'links': data}
+
+    def get(self):
+        """Return {'geocode':.., 'routers':.., 'links':..} or None if a json 
+        file is missing.
+        """
+        files = tuple([self.store.get(name) 
+            for name in ('geocode', 'routers', 'links')])
+        if None in files:
+            return None
+        if files != self._files:
+            self._data = self._build(*[f.obj for f in files])
+            self._files = files
+        return self._data
+
+    def etag(self):
+        """Return a string that changes when the json files change."""
+        files = [self.store.get(name) for name in ('geocode', 'routers', 'links')]
+        return '-'.join([str(f and f.mtime) for f in files])
+
+
+map_topology = MapTopology()
@@ -2,7 +2,7 @@
 # See LICENSE for details.
 
 from django.conf.urls.defaults import patterns, url
-from gmap.views import MapView, SparkLine, DebugView
+from gmap.views import MapView, DebugView
 
 
 urlpatterns = patterns('gmap.views',
@@ -10,14 +10,32 @@ urlpatterns = patterns('gmap.views',
     url(r'^$', MapView.as_view()),
     # add reports on link rates from CCN nodes, respond with ACK ('Got it')
     url(r'^bw/(?P<link>\d+)/(?P<time>\d+\.\d+)/(?P<rx>\d+)/(?P<tx>\d+)/$','bw', name='bw'),
+    # add a batch of reports (POST), respond with ACK ('Got <count>.')
+    url(r'^bw/$', 'bw_batch', name='bw_batch'),
     # respond to XMLHttpRequests from the map script to display link rates
-    url(r'^xhr_bw/(?P<link>[+\d]+)/$', 'xhr_bw', name='xhr_bw'),
+    # (link ids joined by '+', or 'all')
+    url(r'^xhr_bw/(?P<link>all|[+\d]+)/$', 'xhr_bw', name='xhr_bw'),
+    # respond with the topology and link rates to draw the map
+    url(r'^xhr_map/$', 'xhr_map', name='xhr_map'),
+    # push link rates to the map script (server-sent events)
+    url(r'^xhr_bw_stream/$', 'xhr_bw_stream', name='xhr_bw_stream'),
     # respond with HTML for a sparklinke, bandwidth graph
-    url(r'^sparkline/(?P<link>\d+)/$', SparkLine.as_view()),
+    url(r'^sparkline/(?P<link>\d+)/$', 'sparkline'),
+    # respond with an SVG (or PNG) sparkline image of rx or tx rates
+    url(r'^sparkline/(?P<direction>rx|tx)/(?P<link>\d+)\.(?P<format>svg|png)$', 
+        'sparkline_image', name='sparkline_image'),
+    # respond with all reports of a link (gviz data source, streamed)
+    url(r'^history/(?P<link>\d+)/$', 'history', name='history'),
+    # answer Google Visualization queries over all reports
+    url(r'^datasource/$', 'datasource', name='datasource'),
     # respond with json files to avoid cross-site scripting
     url(r'^json/(?P<file>\w+)/$', 'json'),
     # debug
     url(r'^xhr_sparkline/rx/(?P<link>\d+)/$', 'xhr_spark_rx', name='xhr_spark_rx'),
     url(r'^xhr_sparkline/tx/(?P<link>\d+)/$', 'xhr_spark_tx', name='xhr_spark_tx'),
+    # respond with rx and tx sparkline tables of links (joined by '+', or all)
+    url(r'^xhr_sparkline/(?P<link>all|[+\d]+)/$', 'xhr_spark_many', 
+        name='xhr_spark_many'),
+    url(r'^xhr_ingest_stats/$', 'xhr_ingest_stats', name='xhr_ingest_stats'),
     #url(r'^debug/$', DebugView.as_view()),
 )
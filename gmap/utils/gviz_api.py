@@ -34,8 +34,21 @@ try:
   import json
 except ImportError:
   import simplejson as json
+import random
 import types
 
+# Placeholder for JSON text spliced into an encoded object, so the object keys
+# keep the order of the encoder.
+_JSON_SENTINEL = "__gviz_api_%032x__" % random.getrandbits(128)
+
+# Number of rows in each chunk yielded by the Iter... methods.
+_CHUNK_ROWS = 100
+
+
+def _SortKey(value):
+  """Returns the sort key of a cell value: None sorts before any value."""
+  return (value is not None, value)
+
 
 class DataTableException(Exception):
   """The general exception object thrown by DataTable."""
@@ -133,7 +146,8 @@ class DataTable(object):
     3  4  w
   """
 
-  def __init__(self, table_description, data=None, custom_properties=None):
+  def __init__(self, table_description, data=None, custom_properties=None,
+               columnar=False):
     """Initialize the data table from a table schema and (optionally) data.
 
     See the class documentation for more information on table schema and data
@@ -151,13 +165,24 @@ class DataTable(object):
       custom_properties: Optional. A dictionary from string to string that
                          goes into the table's custom properties. This can be
                          later changed by changing self.custom_properties.
+      columnar: Optional. If True, the data is kept in a list per column and
+                ToJSon and ToJSonResponse encode it column by column, with the
+                type coercion of each column chosen once. The output is the
+                same. Only flat table descriptions (no nested dictionaries)
+                are supported. See AppendColumns().
 
     Raises:
       DataTableException: Raised if the data and the description did not match,
                           or did not use the supported formats.
     """
     self.__columns = self.TableDescriptionParser(table_description)
-    self.__data = []
+    self.__columnar = columnar
+    if columnar:
+      if self.__columns[-1]["depth"]:
+        raise DataTableException("Columnar tables need a flat description")
+      self.__coercions = [self._CompileCoercion(col["type"])
+                          for col in self.__columns]
+    self._ClearData()
     self.custom_properties = {}
     if custom_properties is not None:
       self.custom_properties = custom_properties
@@ -259,6 +284,35 @@ class DataTable(object):
     # supported types.
     raise DataTableException("Unsupported type %s" % value_type)
 
+  @staticmethod
+  def _CompileCoercion(value_type):
+    """Returns a function coercing values for a column of value_type.
+
+    Internal helper method. The function returns what CoerceValue returns, but
+    checks the common cases of the type first.
+    """
+    coerce = DataTable.CoerceValue
+    if value_type == "number":
+      number_types = (int, long, float)
+      def CoerceNumber(value):
+        if value is None or isinstance(value, number_types):
+          return value
+        return coerce(value, value_type)
+      return CoerceNumber
+    elif value_type == "string":
+      def CoerceString(value):
+        if value is None or isinstance(value, unicode):
+          return value
+        return coerce(value, value_type)
+      return CoerceString
+    elif value_type == "boolean":
+      def CoerceBoolean(value):
+        if value is None or isinstance(value, bool):
+          return value
+        return coerce(value, value_type)
+      return CoerceBoolean
+    return lambda value: coerce(value, value_type)
+
   @staticmethod
   def EscapeForJSCode(encoder, value):
     if value is None:
@@ -510,8 +564,20 @@ class DataTable(object):
 
   def NumberOfRows(self):
     """Returns the number of rows in the current data stored in the table."""
+    if self.__columnar:
+      return len(self.__row_properties)
     return len(self.__data)
 
+  def _ClearData(self):
+    """Removes all rows. Internal helper method."""
+    if self.__columnar:
+      # A list of values per column (in description order) and a list of
+      # custom properties per row.
+      self.__data = [[] for col in self.__columns]
+      self.__row_properties = []
+    else:
+      self.__data = []
+
   def SetRowsCustomProperties(self, rows, custom_properties):
     """Sets the custom properties for given row(s).
 
@@ -526,7 +592,10 @@ class DataTable(object):
     if not hasattr(rows, "__iter__"):
       rows = [rows]
     for row in rows:
-      self.__data[row] = (self.__data[row][0], custom_properties)
+      if self.__columnar:
+        self.__row_properties[row] = custom_properties
+      else:
+        self.__data[row] = (self.__data[row][0], custom_properties)
 
   def LoadData(self, data, custom_properties=None):
     """Loads new rows to the data table, clearing existing rows.
@@ -540,7 +609,7 @@ class DataTable(object):
       custom_properties: A dictionary of string to string to set as the custom
                          properties for all rows.
     """
-    self.__data = []
+    self._ClearData()
     self.AppendData(data, custom_properties)
 
   def AppendData(self, data, custom_properties=None):
@@ -560,6 +629,9 @@ class DataTable(object):
     Raises:
       DataTableException: The data structure does not match the description.
     """
+    if self.__columnar:
+      self._AppendColumnarData(data, custom_properties)
+      return
     # If the maximal depth is 0, we simply iterate over the data table
     # lines and insert them using _InnerAppendData. Otherwise, we simply
     # let the _InnerAppendData handle all the levels.
@@ -569,6 +641,66 @@ class DataTable(object):
     else:
       self._InnerAppendData(({}, custom_properties), data, 0)
 
+  def _AppendColumnarData(self, data, custom_properties):
+    """Appends rows to a columnar table. Internal helper method."""
+    container = self.__columns[0]["container"]
+    col_ids = [col["id"] for col in self.__columns]
+    num_cols = len(col_ids)
+    appends = [values.append for values in self.__data]
+    count = 0
+    for row in data:
+      if container == "scalar":
+        row = [row]
+      elif container == "iter":
+        if not hasattr(row, "__iter__") or isinstance(row, dict):
+          raise DataTableException("Expected iterable object, got %s" %
+                                   type(row))
+        row = list(row)
+        if len(row) > num_cols:
+          raise DataTableException("Too many elements given in data")
+        # If there are less items than expected, the rest are empty.
+        row.extend([None] * (num_cols - len(row)))
+      else:
+        if not isinstance(row, dict):
+          raise DataTableException("Expected dictionary at current level, "
+                                   "got %s" % type(row))
+        row = [row.get(col_id) for col_id in col_ids]
+      for append, value in zip(appends, row):
+        append(value)
+      count += 1
+    self.__row_properties.extend([custom_properties] * count)
+
+  def AppendColumns(self, columns, custom_properties=None):
+    """Appends new rows to a columnar table, given as columns.
+
+    Args:
+      columns: A dictionary from column ID to a sequence of values, one per
+               new row. All sequences must have the same length. Columns that
+               are not given are empty in the new rows.
+      custom_properties: A dictionary of string to string, representing the
+                         custom properties to add to all the rows.
+
+    Raises:
+      DataTableException: The table is not columnar, a column ID is not in the
+                          table description, or the columns differ in length.
+    """
+    if not self.__columnar:
+      raise DataTableException("AppendColumns needs a columnar table")
+    col_ids = [col["id"] for col in self.__columns]
+    for col_id in columns:
+      if col_id not in col_ids:
+        raise DataTableException("Unknown column %s" % col_id)
+    lengths = set([len(values) for values in columns.values()])
+    if len(lengths) > 1:
+      raise DataTableException("Columns of different lengths given in data")
+    count = lengths and lengths.pop() or 0
+    for col_id, values in zip(col_ids, self.__data):
+      if col_id in columns:
+        values.extend(columns[col_id])
+      else:
+        values.extend([None] * count)
+    self.__row_properties.extend([custom_properties] * count)
+
   def _InnerAppendData(self, prev_col_values, data, col_index):
     """Inner function to assist LoadData."""
     # We first check that col_index has not exceeded the columns size
@@ -620,6 +752,24 @@ class DataTable(object):
         self._InnerAppendData((col_values, prev_col_values[1]),
                               data[key], col_index + 1)
 
+  def _IterPages(self, pages=None):
+    """Loads pages of data one at a time. Internal helper method.
+
+    The Iter... methods write the table data for each iteration. Without
+    pages, the table data is written once. With pages, each page replaces the
+    table data (see LoadData()) before it is written, so a large table can be
+    written holding one page in memory. Rows are sorted within each page.
+
+    Args:
+      pages: Optional. An iterable of data, each in the format of LoadData().
+    """
+    if pages is None:
+      yield None
+      return
+    for page in pages:
+      self.LoadData(page)
+      yield page
+
   def _PreparedData(self, order_by=()):
     """Prepares the data for enumeration - sorting it by order_by.
 
@@ -638,9 +788,75 @@ class DataTable(object):
     Raises:
       DataTableException: Sort direction not in 'asc' or 'desc'
     """
+    data = self.__data
+    if self.__columnar:
+      col_ids = [col["id"] for col in self.__columns]
+      data = [(dict(zip(col_ids, values)), cp)
+              for values, cp in zip(zip(*self.__data), self.__row_properties)]
     if not order_by:
-      return self.__data
+      return data
+
+    data = list(data)
+    for keys, reverse in self._SortPasses(self._ParseOrderBy(order_by)):
+      data.sort(key=self._RowSortKey(keys), reverse=reverse)
+    return data
+
+  @staticmethod
+  def _RowSortKey(keys):
+    """Returns a function of a row, giving its sort key by the given keys.
+
+    Internal helper method. The sort key is flat: a None flag and the value
+    for each key (see _SortKey()).
+    """
+    if len(keys) == 1:
+      key = keys[0]
+      def RowSortKey(row):
+        value = row[0].get(key)
+        return (value is not None, value)
+    else:
+      def RowSortKey(row):
+        cells = row[0]
+        sort_key = []
+        for key in keys:
+          value = cells.get(key)
+          sort_key.append(value is not None)
+          sort_key.append(value)
+        return sort_key
+    return RowSortKey
+
+  @staticmethod
+  def _SortPasses(proper_sort_keys):
+    """Returns the passes of a stable sort by proper_sort_keys.
+
+    Internal helper method. Consecutive keys in the same direction are sorted
+    in one pass. The passes are in the order they are run, the least
+    significant keys first.
+
+    Args:
+      proper_sort_keys: A list of (key, 1 for asc or -1 for desc), as returned
+                        by _ParseOrderBy().
+
+    Returns:
+      A list of (list of keys, reverse) tuples.
+    """
+    passes = []
+    for key, asc_mult in proper_sort_keys:
+      if passes and passes[-1][1] == (asc_mult < 0):
+        passes[-1][0].append(key)
+      else:
+        passes.append(([key], asc_mult < 0))
+    passes.reverse()
+    return passes
+
+  @staticmethod
+  def _ParseOrderBy(order_by):
+    """Returns a list of (column ID, 1 for asc or -1 for desc) of order_by.
 
+    Internal helper method. See _PreparedData() for the accepted formats.
+
+    Raises:
+      DataTableException: Sort direction not in 'asc' or 'desc'
+    """
     proper_sort_keys = []
     if isinstance(order_by, types.StringTypes) or (
         isinstance(order_by, tuple) and len(order_by) == 2 and
@@ -655,16 +871,36 @@ class DataTable(object):
       else:
         raise DataTableException("Expected tuple with second value: "
                                  "'asc' or 'desc'")
+    return proper_sort_keys
 
-    def SortCmpFunc(row1, row2):
-      """cmp function for sorted. Compares by keys and 'asc'/'desc' keywords."""
-      for key, asc_mult in proper_sort_keys:
-        cmp_result = asc_mult * cmp(row1[0].get(key), row2[0].get(key))
-        if cmp_result:
-          return cmp_result
-      return 0
+  def _ColumnarOrder(self, order_by=()):
+    """Returns the row indices of a columnar table sorted by order_by.
 
-    return sorted(self.__data, cmp=SortCmpFunc)
+    Internal helper method. Returns None if order_by is empty. Rows are
+    compared as in _PreparedData().
+    """
+    if not order_by:
+      return None
+    col_index = dict([(col["id"], i) for i, col in enumerate(self.__columns)])
+    order = range(self.NumberOfRows())
+    for keys, reverse in self._SortPasses(self._ParseOrderBy(order_by)):
+      # Sort keys are computed once per column (columns without None are their
+      # own keys), and rows are sorted by them.
+      key_columns = []
+      for key in keys:
+        if key in col_index:
+          values = self.__data[col_index[key]]
+          if None in values:
+            values = [_SortKey(value) for value in values]
+          key_columns.append(values)
+      if not key_columns:
+        continue
+      if len(key_columns) == 1:
+        row_keys = key_columns[0]
+      else:
+        row_keys = zip(*key_columns)
+      order.sort(key=row_keys.__getitem__, reverse=reverse)
+    return order
 
   def ToJSCode(self, name, columns_order=None, order_by=()):
     """Writes the data table as a JS code string.
@@ -727,7 +963,7 @@ class DataTable(object):
       if col_dict[col]["custom_properties"]:
         jscode += "%s.setColumnProperties(%d, %s);\n" % (
             name, i, encoder.encode(col_dict[col]["custom_properties"]))
-    jscode += "%s.addRows(%d);\n" % (name, len(self.__data))
+    jscode += "%s.addRows(%d);\n" % (name, self.NumberOfRows())
 
     # We now go over the data and add each row
     for (i, (row, cp)) in enumerate(self._PreparedData(order_by)):
@@ -776,12 +1012,27 @@ class DataTable(object):
         </tbody>
        </table></body></html>
 
+    Raises:
+      DataTableException: The data does not match the type.
+    """
+    return "".join(self.IterHtml(columns_order, order_by))
+
+  def IterHtml(self, columns_order=None, order_by=(), pages=None):
+    """Writes the data table as HTML table code, in chunks of rows.
+
+    Args:
+      columns_order: Optional. As for ToHtml().
+      order_by: Optional. As for ToHtml().
+      pages: Optional. See _IterPages().
+
+    Returns:
+      A generator of strings which joined are the ToHtml() string.
+
     Raises:
       DataTableException: The data does not match the type.
     """
     table_template = "<html><body><table border=\"1\">%s</table></body></html>"
     columns_template = "<thead><tr>%s</tr></thead>"
-    rows_template = "<tbody>%s</tbody>"
     row_template = "<tr>%s</tr>"
     header_cell_template = "<th>%s</th>"
     cell_template = "<td>%s</td>"
@@ -795,26 +1046,34 @@ class DataTable(object):
       columns_list.append(header_cell_template %
                           cgi.escape(col_dict[col]["label"]))
     columns_html = columns_template % "".join(columns_list)
+    table_start, table_end = table_template.split("%s")
+    yield table_start + columns_html + "<tbody>"
+
+    for unused_page in self._IterPages(pages):
+      rows_list = []
+      # We now go over the data and add each row
+      for row, unused_cp in self._PreparedData(order_by):
+        cells_list = []
+        # We add all the elements of this row by their order
+        for col in columns_order:
+          # For empty string we want empty quotes ("").
+          value = ""
+          if col in row and row[col] is not None:
+            value = self.CoerceValue(row[col], col_dict[col]["type"])
+          if isinstance(value, tuple):
+            # We have a formatted value and we're going to use it
+            cells_list.append(cell_template %
+                              cgi.escape(self.ToString(value[1])))
+          else:
+            cells_list.append(cell_template % cgi.escape(self.ToString(value)))
+        rows_list.append(row_template % "".join(cells_list))
+        if len(rows_list) == _CHUNK_ROWS:
+          yield "".join(rows_list)
+          rows_list = []
+      if rows_list:
+        yield "".join(rows_list)
 
-    rows_list = []
-    # We now go over the data and add each row
-    for row, unused_cp in self._PreparedData(order_by):
-      cells_list = []
-      # We add all the elements of this row by their order
-      for col in columns_order:
-        # For empty string we want empty quotes ("").
-        value = ""
-        if col in row and row[col] is not None:
-          value = self.CoerceValue(row[col], col_dict[col]["type"])
-        if isinstance(value, tuple):
-          # We have a formatted value and we're going to use it
-          cells_list.append(cell_template % cgi.escape(self.ToString(value[1])))
-        else:
-          cells_list.append(cell_template % cgi.escape(self.ToString(value)))
-      rows_list.append(row_template % "".join(cells_list))
-    rows_html = rows_template % "".join(rows_list)
-
-    return table_template % (columns_html + rows_html)
+    yield "</tbody>" + table_end
 
   def ToCsv(self, columns_order=None, order_by=(), separator=","):
     """Writes the data table as a CSV string.
@@ -843,34 +1102,65 @@ class DataTable(object):
       DataTableException: The data does not match the type.
     """
 
+    return "".join(self.IterCsv(columns_order, order_by, separator))
+
+  def IterCsv(self, columns_order=None, order_by=(), separator=",",
+              pages=None):
+    """Writes the data table as CSV, in chunks of rows.
+
+    Args:
+      columns_order: Optional. As for ToCsv().
+      order_by: Optional. As for ToCsv().
+      separator: Optional. As for ToCsv().
+      pages: Optional. See _IterPages().
+
+    Returns:
+      A generator of UTF-8 strings which joined are the ToCsv() string.
+
+    Raises:
+      DataTableException: The data does not match the type.
+    """
+
     csv_buffer = cStringIO.StringIO()
     writer = csv.writer(csv_buffer, delimiter=separator)
 
+    def Flush():
+      chunk = csv_buffer.getvalue()
+      csv_buffer.seek(0)
+      csv_buffer.truncate()
+      return chunk
+
     if columns_order is None:
       columns_order = [col["id"] for col in self.__columns]
     col_dict = dict([(col["id"], col) for col in self.__columns])
 
     writer.writerow([col_dict[col]["label"].encode("utf-8")
                      for col in columns_order])
-
-    # We now go over the data and add each row
-    for row, unused_cp in self._PreparedData(order_by):
-      cells_list = []
-      # We add all the elements of this row by their order
-      for col in columns_order:
-        value = ""
-        if col in row and row[col] is not None:
-          value = self.CoerceValue(row[col], col_dict[col]["type"])
-        if isinstance(value, tuple):
-          # We have a formatted value. Using it only for date/time types.
-          if col_dict[col]["type"] in ["date", "datetime", "timeofday"]:
-            cells_list.append(self.ToString(value[1]).encode("utf-8"))
+    yield Flush()
+
+    for unused_page in self._IterPages(pages):
+      # We now go over the data and add each row
+      for i, (row, unused_cp) in enumerate(self._PreparedData(order_by)):
+        cells_list = []
+        # We add all the elements of this row by their order
+        for col in columns_order:
+          value = ""
+          if col in row and row[col] is not None:
+            value = self.CoerceValue(row[col], col_dict[col]["type"])
+          if isinstance(value, tuple):
+            # We have a formatted value. Using it only for date/time types.
+            if col_dict[col]["type"] in ["date", "datetime", "timeofday"]:
+              cells_list.append(self.ToString(value[1]).encode("utf-8"))
+            else:
+              cells_list.append(self.ToString(value[0]).encode("utf-8"))
           else:
-            cells_list.append(self.ToString(value[0]).encode("utf-8"))
-        else:
-          cells_list.append(self.ToString(value).encode("utf-8"))
-      writer.writerow(cells_list)
-    return csv_buffer.getvalue()
+            cells_list.append(self.ToString(value).encode("utf-8"))
+        writer.writerow(cells_list)
+        if (i + 1) % _CHUNK_ROWS == 0:
+          yield Flush()
+      chunk = Flush()
+      if chunk:
+        yield chunk
 
   def ToTsvExcel(self, columns_order=None, order_by=()):
     """Returns a file in tab-separated-format readable by MS Excel.
@@ -888,6 +1178,22 @@ class DataTable(object):
     return (self.ToCsv(columns_order, order_by, separator="\t")
             .decode("utf-8").encode("UTF-16LE"))
 
+  def IterTsvExcel(self, columns_order=None, order_by=(), pages=None):
+    """Writes the ToTsvExcel() file in chunks of rows.
+
+    Args:
+      columns_order: Delegated to IterCsv.
+      order_by: Delegated to IterCsv.
+      pages: Delegated to IterCsv.
+
+    Returns:
+      A generator of strings which joined are the ToTsvExcel() file.
+    """
+    # Chunks end with a row, so they are whole UTF-8 strings.
+    for chunk in self.IterCsv(columns_order, order_by, separator="\t",
+                              pages=pages):
+      yield chunk.decode("utf-8").encode("UTF-16LE")
+
   def _ToJSonObj(self, columns_order=None, order_by=()):
     """Returns an object suitable to be converted to JSON.
 
@@ -906,6 +1212,43 @@ class DataTable(object):
     col_dict = dict([(col["id"], col) for col in self.__columns])
 
     # Creating the column JSON objects
+    col_objs = self._ColumnsJSonObj(columns_order)
+
+    # Creating the rows jsons
+    row_objs = []
+    for row, cp in self._PreparedData(order_by):
+      row_objs.append(self._RowJSonObj(row, cp, columns_order, col_dict))
+
+    json_obj = {"cols": col_objs, "rows": row_objs}
+    if self.custom_properties:
+      json_obj["p"] = self.custom_properties
+
+    return json_obj
+
+  def _RowJSonObj(self, row, cp, columns_order, col_dict):
+    """Returns a row object suitable to be converted to JSON."""
+    cell_objs = []
+    for col in columns_order:
+      value = self.CoerceValue(row.get(col, None), col_dict[col]["type"])
+      if value is None:
+        cell_obj = None
+      elif isinstance(value, tuple):
+        cell_obj = {"v": value[0]}
+        if len(value) > 1 and value[1] is not None:
+          cell_obj["f"] = value[1]
+        if len(value) == 3:
+          cell_obj["p"] = value[2]
+      else:
+        cell_obj = {"v": value}
+      cell_objs.append(cell_obj)
+    row_obj = {"c": cell_objs}
+    if cp:
+      row_obj["p"] = cp
+    return row_obj
+
+  def _ColumnsJSonObj(self, columns_order):
+    """Returns a list of column objects suitable to be converted to JSON."""
+    col_dict = dict([(col["id"], col) for col in self.__columns])
     col_objs = []
     for col_id in columns_order:
       col_obj = {"id": col_dict[col_id]["id"],
@@ -914,35 +1257,130 @@ class DataTable(object):
       if col_dict[col_id]["custom_properties"]:
         col_obj["p"] = col_dict[col_id]["custom_properties"]
       col_objs.append(col_obj)
+    return col_objs
 
-    # Creating the rows jsons
-    row_objs = []
-    for row, cp in self._PreparedData(order_by):
-      cell_objs = []
-      for col in columns_order:
-        value = self.CoerceValue(row.get(col, None), col_dict[col]["type"])
-        if value is None:
-          cell_obj = None
-        elif isinstance(value, tuple):
-          cell_obj = {"v": value[0]}
-          if len(value) > 1 and value[1] is not None:
-            cell_obj["f"] = value[1]
-          if len(value) == 3:
-            cell_obj["p"] = value[2]
-        else:
-          cell_obj = {"v": value}
-        cell_objs.append(cell_obj)
-      row_obj = {"c": cell_objs}
+  @staticmethod
+  def _SpliceJSon(encoder, obj, key, json_str):
+    """Encodes obj with the JSON string json_str as the value of obj[key].
+
+    obj[key] must exist: replacing its value keeps the order of the keys.
+    """
+    obj[key] = _JSON_SENTINEL
+    return encoder.encode(obj).replace(encoder.encode(_JSON_SENTINEL),
+                                       json_str, 1)
+
+  @staticmethod
+  def _CellsJSon(encoder, value_type, coerce, values):
+    """Returns the JSON strings of the cells of a column. Internal helper."""
+    values = [coerce(value) for value in values]
+    if (value_type in ("number", "boolean") and
+        not [value for value in values if isinstance(value, tuple)]):
+      # Numbers, booleans and nulls have no commas, so the column is
+      # encoded at once and split.
+      if not values:
+        return []
+      value_strs = encoder.encode(values)[1:-1].split(",")
+      return [value is None and "null" or "{\"v\":%s}" % value_str
+              for value, value_str in zip(values, value_strs)]
+    cells = []
+    for value in values:
+      if value is None:
+        cells.append("null")
+      elif isinstance(value, tuple):
+        cell_obj = {"v": value[0]}
+        if len(value) > 1 and value[1] is not None:
+          cell_obj["f"] = value[1]
+        if len(value) == 3:
+          cell_obj["p"] = value[2]
+        cells.append(encoder.encode(cell_obj))
+      else:
+        cells.append("{\"v\":%s}" % encoder.encode(value))
+    return cells
+
+  def _ColumnarRowStrs(self, encoder, columns_order, order_by=()):
+    """Returns the JSON strings of the rows of a columnar table.
+
+    Internal helper method. The rows are encoded column by column.
+    """
+    col_index = dict([(col["id"], i) for i, col in enumerate(self.__columns)])
+    order = self._ColumnarOrder(order_by)
+
+    columns_cells = []
+    for col_id in columns_order:
+      i = col_index[col_id]
+      values = self.__data[i]
+      if order is not None:
+        values = [values[k] for k in order]
+      columns_cells.append(self._CellsJSon(encoder, self.__columns[i]["type"],
+                                           self.__coercions[i], values))
+    row_properties = self.__row_properties
+    if order is not None:
+      row_properties = [row_properties[k] for k in order]
+
+    row_strs = []
+    for cells, cp in zip(zip(*columns_cells), row_properties):
+      cells_str = "[%s]" % ",".join(cells)
       if cp:
-        row_obj["p"] = cp
-      row_objs.append(row_obj)
+        row_strs.append(self._SpliceJSon(encoder, {"c": None, "p": cp}, "c",
+                                         cells_str))
+      else:
+        row_strs.append("{\"c\":%s}" % cells_str)
+    return row_strs
+
+  def _IterRowStrs(self, encoder, columns_order, order_by=()):
+    """Yields the JSON string of each row. Internal helper method."""
+    if self.__columnar:
+      for row_str in self._ColumnarRowStrs(encoder, columns_order, order_by):
+        yield row_str
+      return
+    col_dict = dict([(col["id"], col) for col in self.__columns])
+    for row, cp in self._PreparedData(order_by):
+      yield encoder.encode(self._RowJSonObj(row, cp, columns_order, col_dict))
 
-    json_obj = {"cols": col_objs, "rows": row_objs}
+  def _TableJSonObj(self, columns_order):
+    """Returns _ToJSonObj() with None for the rows. Internal helper method."""
+    json_obj = {"cols": self._ColumnsJSonObj(columns_order), "rows": None}
     if self.custom_properties:
       json_obj["p"] = self.custom_properties
-
     return json_obj
 
+  def _ColumnarJSon(self, encoder, columns_order=None, order_by=()):
+    """Returns the JSON string of a columnar table.
+
+    Internal helper method. The string is the encoding of _ToJSonObj(), but
+    the rows are encoded column by column.
+    """
+    if columns_order is None:
+      columns_order = [col["id"] for col in self.__columns]
+    row_strs = self._ColumnarRowStrs(encoder, columns_order, order_by)
+    return self._SpliceJSon(encoder, self._TableJSonObj(columns_order), "rows",
+                            "[%s]" % ",".join(row_strs))
+
+  def _IterJSonParts(self, encoder, columns_order=None, order_by=(),
+                     pages=None):
+    """Yields the parts of the JSON string of the table (not UTF-8 encoded).
+
+    Internal helper method.
+    """
+    if columns_order is None:
+      columns_order = [col["id"] for col in self.__columns]
+    table_start, table_end = self._SpliceJSon(
+        encoder, self._TableJSonObj(columns_order), "rows",
+        _JSON_SENTINEL).split(_JSON_SENTINEL)
+    yield table_start + "["
+    separator = ""
+    for unused_page in self._IterPages(pages):
+      row_strs = []
+      for row_str in self._IterRowStrs(encoder, columns_order, order_by):
+        row_strs.append(row_str)
+        if len(row_strs) == _CHUNK_ROWS:
+          yield separator + ",".join(row_strs)
+          separator, row_strs = ",", []
+      if row_strs:
+        yield separator + ",".join(row_strs)
+        separator = ","
+    yield "]" + table_end
+
   def ToJSon(self, columns_order=None, order_by=()):
     """Returns a string that can be used in a JS DataTable constructor.
 
@@ -982,9 +1420,30 @@ class DataTable(object):
     """
 
     encoder = DataTableJSONEncoder()
+    if self.__columnar:
+      return self._ColumnarJSon(encoder, columns_order,
+                                order_by).encode("utf-8")
     return encoder.encode(
         self._ToJSonObj(columns_order, order_by)).encode("utf-8")
 
+  def IterJSon(self, columns_order=None, order_by=(), pages=None):
+    """Writes the ToJSon() string in chunks of rows.
+
+    Args:
+      columns_order: Optional. As for ToJSon().
+      order_by: Optional. As for ToJSon().
+      pages: Optional. See _IterPages().
+
+    Returns:
+      A generator of UTF-8 strings which joined are the ToJSon() string.
+
+    Raises:
+      DataTableException: The data does not match the type.
+    """
+    encoder = DataTableJSONEncoder()
+    for part in self._IterJSonParts(encoder, columns_order, order_by, pages):
+      yield part.encode("utf-8")
+
   def ToJSonResponse(self, columns_order=None, order_by=(), req_id=0,
                      response_handler="google.visualization.Query.setResponse"):
     """Writes a table as a JSON response that can be returned as-is to a client.
@@ -1014,15 +1473,56 @@ class DataTable(object):
           Visualization Gadgets or from JS code.
     """
 
+    encoder = DataTableJSONEncoder()
+    if self.__columnar:
+      response_obj = {
+          "version": "0.6",
+          "reqId": str(req_id),
+          "table": None,
+          "status": "ok"
+      }
+      response_str = self._SpliceJSon(
+          encoder, response_obj, "table",
+          self._ColumnarJSon(encoder, columns_order, order_by))
+    else:
+      response_obj = {
+          "version": "0.6",
+          "reqId": str(req_id),
+          "table": self._ToJSonObj(columns_order, order_by),
+          "status": "ok"
+      }
+      response_str = encoder.encode(response_obj)
+    return "%s(%s);" % (response_handler, response_str.encode("utf-8"))
+
+  def IterJSonResponse(self, columns_order=None, order_by=(), req_id=0,
+                       response_handler="google.visualization.Query.setResponse",
+                       pages=None):
+    """Writes the ToJSonResponse() string in chunks of rows.
+
+    Args:
+      columns_order: Optional. As for ToJSonResponse().
+      order_by: Optional. As for ToJSonResponse().
+      req_id: Optional. As for ToJSonResponse().
+      response_handler: Optional. As for ToJSonResponse().
+      pages: Optional. See _IterPages().
+
+    Returns:
+      A generator of UTF-8 strings which joined are the ToJSonResponse()
+      string.
+    """
+    encoder = DataTableJSONEncoder()
     response_obj = {
         "version": "0.6",
         "reqId": str(req_id),
-        "table": self._ToJSonObj(columns_order, order_by),
+        "table": None,
         "status": "ok"
     }
-    encoder = DataTableJSONEncoder()
-    return "%s(%s);" % (response_handler,
-                        encoder.encode(response_obj).encode("utf-8"))
+    response_start, response_end = self._SpliceJSon(
+        encoder, response_obj, "table", _JSON_SENTINEL).split(_JSON_SENTINEL)
+    yield "%s(%s" % (response_handler, response_start.encode("utf-8"))
+    for part in self._IterJSonParts(encoder, columns_order, order_by, pages):
+      yield part.encode("utf-8")
+    yield "%s);" % response_end.encode("utf-8")
 
   def ToResponse(self, columns_order=None, order_by=(), tqx=""):
     """Writes the right response according to the request string passed in tqx.
@@ -1072,3 +1572,45 @@ class DataTable(object):
     else:
       raise DataTableException(
           "'out' parameter: '%s' is not supported" % tqx_dict["out"])
+
+  def IterResponse(self, columns_order=None, order_by=(), tqx="", pages=None):
+    """Writes the ToResponse() response in chunks of rows.
+
+    The tqx request string is checked before the generator is returned.
+
+    Args:
+      columns_order: Optional. As for ToResponse().
+      order_by: Optional. As for ToResponse().
+      tqx: Optional. As for ToResponse().
+      pages: Optional. See _IterPages().
+
+    Returns:
+      A generator of strings which joined are the ToResponse() response.
+
+    Raises:
+      DataTableException: One of the parameters passed in tqx is not supported.
+    """
+    tqx_dict = {}
+    if tqx:
+      tqx_dict = dict(opt.split(":") for opt in tqx.split(";"))
+    if tqx_dict.get("version", "0.6") != "0.6":
+      raise DataTableException(
+          "Version (%s) passed by request is not supported."
+          % tqx_dict["version"])
+
+    if tqx_dict.get("out", "json") == "json":
+      response_handler = tqx_dict.get("responseHandler",
+                                      "google.visualization.Query.setResponse")
+      return self.IterJSonResponse(columns_order, order_by,
+                                   req_id=tqx_dict.get("reqId", 0),
+                                   response_handler=response_handler,
+                                   pages=pages)
+    elif tqx_dict["out"] == "html":
+      return self.IterHtml(columns_order, order_by, pages=pages)
+    elif tqx_dict["out"] == "csv":
+      return self.IterCsv(columns_order, order_by, pages=pages)
+    elif tqx_dict["out"] == "tsv-excel":
+      return self.IterTsvExcel(columns_order, order_by, pages=pages)
+    else:
+      raise DataTableException(
+          "'out' parameter: '%s' is not supported" % tqx_dict["out"])
@@ -1,12 +1,29 @@
 # Copyright (c) 2012 Shakir James and Washington University in St. Louis.
 # See LICENSE for details.
 
+import math
+import threading
+import time
+from multiprocessing.pool import ThreadPool
+from datetime import datetime, timedelta
 from django.conf import settings
 from django.core import serializers
+from django.core.cache import cache
 from django.core.urlresolvers import reverse 
-from django.http import HttpResponse, Http404
-from gmap.models import Bandwidth
+from django.http import HttpResponse, HttpResponseBadRequest, Http404
+from gmap import charts
+from gmap.datasource import Query, QueryError
+from gmap.ingest import WRITE_BEHIND, write_behind
+from gmap.models import Bandwidth, BandwidthRollup
+from gmap.rates import lttb, lttb_indices
+from gmap.snapshot import RateSnapshot
+from gmap.sparklines import sparkline_cache
+from gmap.topology import map_topology, topology
 from django.template import RequestContext
+from django.views.decorators.cache import cache_control
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import condition, require_POST
+from django.views.decorators.vary import vary_on_headers
 from django.views.generic import TemplateView
 from utils import gviz_api
 
@@ -14,55 +31,464 @@ MAP_API_KEY = getattr(settings, 'GMAP_API_KEY', '')
 BW_UPDATE_INTERVAL = getattr(settings, 'GMAP_BW_UPDATE_INTERVAL', 5)
 BW_DIVISOR = 1000.0 # Kbps
 BW_DECIMAL_POINTS=1
+# proxies and browsers may reuse rates for an update interval
+BW_MAX_AGE = int(BW_UPDATE_INTERVAL)
+# topology files are revalidated every JSON_MAX_AGE seconds
+JSON_MAX_AGE = getattr(settings, 'GMAP_JSON_MAX_AGE', 300)
+# load the topology json files once per process
+topology.preload()
+# rates of all links, computed once per BW_UPDATE_INTERVAL
+rate_snapshot = RateSnapshot(BW_UPDATE_INTERVAL, BW_DIVISOR, BW_DECIMAL_POINTS)
+# streams end after BW_STREAM_DURATION seconds (browsers reconnect)
+BW_STREAM_DURATION = getattr(settings, 'GMAP_BW_STREAM_DURATION', 300)
+# refuse streams beyond BW_STREAM_MAX (each one holds a server thread)
+BW_STREAM_MAX = getattr(settings, 'GMAP_BW_STREAM_MAX', 48)
+BW_STREAM_KEEPALIVE = 15 # s
+_streams = [0]
+_streams_lock = threading.Lock()
+# sparklines show at most SPARKLINE_LIMIT rates unless a range is requested
+SPARKLINE_LIMIT = getattr(settings, 'GMAP_SPARKLINE_LIMIT', 300)
+# sparklines are downsampled to SPARKLINE_POINTS rates (the chart width)
+SPARKLINE_POINTS = getattr(settings, 'GMAP_SPARKLINE_POINTS', 190)
+# sparkline images are kept in the Django cache for SPARKLINE_IMAGE_TIMEOUT s
+SPARKLINE_IMAGE_TIMEOUT = getattr(settings, 'GMAP_SPARKLINE_IMAGE_TIMEOUT', 
+    300)
+# sparkline images show at most the last SPARKLINE_MAX_SECONDS
+SPARKLINE_MAX_SECONDS = getattr(settings, 'GMAP_SPARKLINE_MAX_SECONDS', 86400)
+SPARKLINE_IMAGE_TYPES = {
+    'svg': 'image/svg+xml',
+    'png': 'image/png',
+}
+# sparklines of many links show the last SPARKLINE_SECONDS by default
+SPARKLINE_SECONDS = getattr(settings, 'GMAP_SPARKLINE_SECONDS', 600)
+# rates of more than SPARKLINE_POOL_THRESHOLD links are computed by
+# SPARKLINE_POOL_SIZE threads
+SPARKLINE_POOL_SIZE = getattr(settings, 'GMAP_SPARKLINE_POOL_SIZE', 4)
+SPARKLINE_POOL_THRESHOLD = getattr(settings, 'GMAP_SPARKLINE_POOL_THRESHOLD', 
+    32)
+_spark_pool = []
+_spark_pool_lock = threading.Lock()
+# history exports hold HISTORY_PAGE_SIZE reports in memory at a time
+HISTORY_PAGE_SIZE = getattr(settings, 'GMAP_HISTORY_PAGE_SIZE', 1000)
+HISTORY_DESCRIPTION = [('update_date', 'datetime', 'Received'), 
+    ('time', 'number', 'Time'), ('rx', 'number', 'Rx (bits)'), 
+    ('tx', 'number', 'Tx (bits)')]
+GVIZ_MIMETYPES = {
+    'json': 'text/javascript; charset=utf-8',
+    'html': 'text/html; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8',
+    'tsv-excel': 'text/tab-separated-values; charset=utf-16le',
+}
 
 def bw(request, link , time, rx, tx):
     """Add bandwidth reports."""
+    if WRITE_BEHIND:
+        if not write_behind.put((int(link), float(time), int(rx), int(tx))):
+            return HttpResponse('Busy.\n', status=503)
+        return HttpResponse('Got it.\n')
     # WARNING: This is not safe!
     Bandwidth.objects.create(link=link, time=time, rx=rx, tx=tx)
     return HttpResponse('Got it.\n')
 
+def _report_int(value):
+    """Return an integer report field; JSON bools and floats are rejected
+    (int() would take true as 1 and truncate 1.9)."""
+    if isinstance(value, (bool, float)):
+        raise ValueError
+    return int(value)
+
+def _report_time(value):
+    """Return a finite report time."""
+    if isinstance(value, bool):
+        raise ValueError
+    value = float(value)
+    if math.isinf(value) or math.isnan(value):
+        raise ValueError
+    return value
+
+def _parse_reports(data):
+    """Return a list of (link, time, rx, tx) tuples from a batch report.
+
+    The batch is either a JSON array of [link, time, rx, tx] arrays, or
+    one report per line with fields separated by '/' or whitespace:
+        <link>/<time>/<rx_bits>/<tx_bits>
+    Raises ValueError (with the offending report number) on bad input.
+    """
+    import json
+    data = data.strip()
+    if data.startswith('['):
+        items = json.loads(data)
+        if not isinstance(items, list):
+            raise ValueError('expected a JSON array')
+    else:
+        items = [line.replace('/', ' ').split() 
+            for line in data.splitlines() if line.strip()]
+    reports = []
+    for n, item in enumerate(items):
+        try:
+            link, time, rx, tx = item
+            report = (_report_int(link), _report_time(time), 
+                _report_int(rx), _report_int(tx))
+        except (TypeError, ValueError):
+            raise ValueError('invalid report {0}'.format(n + 1))
+        if min(report) < 0:
+            raise ValueError('invalid report {0}'.format(n + 1))
+        reports.append(report)
+    return reports
+
+@csrf_exempt
+@require_POST
+def bw_batch(request):
+    """Add a batch of bandwidth reports with one multi-row insert."""
+    try:
+        reports = _parse_reports(request.raw_post_data)
+    except ValueError as e:
+        return HttpResponseBadRequest('{0}\n'.format(e))
+    if WRITE_BEHIND:
+        # all reports are buffered or none: a retry stores no duplicates
+        count = write_behind.put_many(reports)
+        if count < len(reports):
+            return HttpResponse('Busy.\n', status=503)
+    else:
+        count = Bandwidth.objects.add_reports(reports)
+    return HttpResponse('Got {0}.\n'.format(count))
+
+def _accepts_gzip(request):
+    """Return True if the Accept-Encoding header accepts gzip (q > 0)."""
+    codings = {}
+    for coding in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        params = coding.split(';')
+        q = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        codings[params[0].strip().lower()] = q
+    return codings.get('gzip', codings.get('*', 0.0)) > 0
+
+def _json_modified(request, file):
+    f = topology.get(file)
+    return f and f.last_modified
+
+@vary_on_headers('Accept-Encoding')
+@cache_control(max_age=JSON_MAX_AGE)
+@condition(last_modified_func=_json_modified)
 def json(request, file):
-    """Return the content of a json file."""
+    """Return the content of a json file (gzipped if accepted)."""
     # http://ndnmap.arl.wustl.edu/json/ec2regions/
-    f = '{0}/gmap/json/{1}.json'.format(settings.SITE_ROOT, file)    
-    try:
-        data = open(f, 'r').read()
-    except IOError:
+    f = topology.get(file)
+    if f is None:
         raise Http404
-    return HttpResponse(data, 'application/json')
+    if _accepts_gzip(request):
+        response = HttpResponse(f.gzipped, 'application/json')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        response = HttpResponse(f.data, 'application/json')
+    return response
+
+def _links(link):
+    """Return the link ids of a '+' separated list (empty ids are ignored)."""
+    return [int(l) for l in link.split('+') if l]
+
+def _bw_version(request):
+    """Return the ?v=<n> payload version of a rates request (1 or 2)."""
+    version = request.GET.get('v', '1')
+    if version not in ('1', '2'):
+        raise Http404
+    return int(version)
 
+def _bw_etag(request, link):
+    """Return the sequence number of the last rate change of the links."""
+    snapshot = rate_snapshot.get()
+    if link == 'all' or 'since' in request.GET:
+        return 'bw-{0}'.format(snapshot.seq)
+    changed = [snapshot.changed.get(l, 0) for l in _links(link)]
+    return 'bw-{0}'.format(max([0] + changed))
+
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_bw_etag)
 def xhr_bw(request, link):
-    """Return JSON data with link rate."""
+    """Return JSON data with link rate.
+    
+    With ?since=<seq>, return {'seq': <seq>, 'links': [...]} with only the
+    links whose rates changed after sequence number since. With ?v=2, 
+    return the compact payload (see gmap.snapshot) instead.
+    """
     import json
-    links = link.strip('+').split('+')
-    data = []
-    for link in links :
-        rx, tx = Bandwidth.objects.rate(link)
-        rx = round(rx/BW_DIVISOR, BW_DECIMAL_POINTS)
-        tx = round(tx/BW_DIVISOR, BW_DECIMAL_POINTS)
-        data.append( {'id':link, 'rx':rx, 'tx':tx} )
+    snapshot = rate_snapshot.get()
+    compact = _bw_version(request) == 2
+    since = request.GET.get('since')
+    if since is not None:
+        try:
+            since = int(since)
+        except ValueError:
+            raise Http404
+        data = snapshot.delta(since)
+        if link != 'all':
+            links = set(_links(link))
+            data = [d for d in data if int(d['id']) in links]
+        if compact:
+            return HttpResponse(snapshot.compact(data), 'application/json')
+        data = json.dumps({'seq': snapshot.seq, 'links': data})
+        return HttpResponse(data, 'application/json')
+    if link == 'all':
+        if compact:
+            return HttpResponse(snapshot.compact_payload, 'application/json')
+        return HttpResponse(snapshot.payload, 'application/json')
+    data = snapshot.select(_links(link))
+    if compact:
+        return HttpResponse(snapshot.compact(data), 'application/json')
     # Backward compatability
     if len(data) == 1 :
         data = data[0]
     data = json.dumps(data)
     return HttpResponse(data, 'application/json')
 
-def _spark_json(link, field):
-    data = ({field: (round(v/BW_DIVISOR, BW_DECIMAL_POINTS))}
-        for v in Bandwidth.objects.rates(field, link))
-    data_table = gviz_api.DataTable({field:('number', 'Bandwidth')})
-    data_table.LoadData(data)
+def _map_etag(request):
+    return 'map-{0}-{1}'.format(map_topology.etag(), rate_snapshot.get().seq)
+
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_map_etag)
+def xhr_map(request):
+    """Return JSON data to draw the map: the topology (with the coordinates
+    of each link) and the rates of all links.
+    """
+    import json
+    data = map_topology.get()
+    if data is None:
+        raise Http404
+    snapshot = rate_snapshot.get()
+    data = dict(data, seq=snapshot.seq, rates=snapshot.data)
+    return HttpResponse(json.dumps(data), 'application/json')
+
+def _bw_events(duration, version=1):
+    """Yield server-sent events with the rates of all links."""
+    yield 'retry: {0}\n\n'.format(int(BW_UPDATE_INTERVAL*1000))
+    end = time.time() + duration
+    last, sent = None, time.time()
+    while time.time() < end:
+        snapshot = rate_snapshot.get()
+        if snapshot.payload != last:
+            last, sent = snapshot.payload, time.time()
+            if version == 2:
+                yield 'data: {0}\n\n'.format(snapshot.compact_payload)
+            else:
+                yield 'data: {0}\n\n'.format(snapshot.payload)
+        elif time.time() - sent > BW_STREAM_KEEPALIVE:
+            sent = time.time()
+            yield ': keep-alive\n\n'
+        # wake up at the start of the next update interval
+        time.sleep(BW_UPDATE_INTERVAL - time.time() % BW_UPDATE_INTERVAL)
+
+class _Stream(object):
+    """Events of a stream that holds one of the BW_STREAM_MAX slots.
+
+    The slot is taken when the stream is created and given back on close,
+    which the WSGI server calls even if the events were never iterated.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self.closed = False
+
+    @classmethod
+    def open(cls, events):
+        """Return a stream of events, or None if no slot is free."""
+        with _streams_lock:
+            if _streams[0] >= BW_STREAM_MAX:
+                return None
+            _streams[0] += 1
+        return cls(events)
+
+    def __iter__(self):
+        return iter(self.events)
+
+    def close(self):
+        with _streams_lock:
+            if self.closed:
+                return
+            self.closed = True
+            _streams[0] -= 1
+        self.events.close()
+
+def xhr_bw_stream(request):
+    """Stream the rates of all links as server-sent events (?v=2 for 
+    compact payloads)."""
+    version = _bw_version(request)
+    stream = _Stream.open(_bw_events(BW_STREAM_DURATION, version))
+    if stream is None:
+        return HttpResponse('Busy.\n', status=503)
+    response = HttpResponse(stream, 'text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    return response
+
+def _positive(value):
+    """Return value as a positive integer (None stays None)."""
+    if value is None:
+        return None
+    try:
+        value = int(value)
+    except ValueError:
+        raise Http404
+    if value <= 0:
+        raise Http404
+    return value
+
+def _spark_range(request):
+    """Return the (seconds, limit) range of a sparkline request.
+
+    ?seconds=<n> shows the last n seconds, ?limit=<n> the last n rates. 
+    Without either, the last SPARKLINE_LIMIT rates are shown. Values that
+    are not positive integers are not found.
+    """
+    seconds, limit = [_positive(request.GET.get(name)) 
+        for name in ('seconds', 'limit')]
+    if seconds is None and limit is None:
+        limit = SPARKLINE_LIMIT
+    return (seconds, limit)
+
+def _spark_points(request):
+    """Return the number of rates a sparkline request is downsampled to:
+    ?points=<n>, or SPARKLINE_POINTS. Values that are not positive integers
+    are not found.
+    """
+    return _positive(request.GET.get('points')) or SPARKLINE_POINTS
+
+def _spark_downsample(series, points):
+    """Return (rx, tx) rate lists downsampled to points rates each (see 
+    rates.lttb).
+
+    The rates are picked on rx + tx and the same rates are kept in both 
+    lists, so each table row holds the rx and tx of one window.
+    """
+    rx, tx = series
+    indices = lttb_indices([r + t for r, t in zip(rx, tx)], points)
+    return ([rx[i] for i in indices], [tx[i] for i in indices])
+
+def _spark_after(request):
+    """Return the ?after=<seq> sequence number of a sparkline request (or
+    None): only the rates of reports after seq are requested.
+    """
+    after = request.GET.get('after')
+    if after is None:
+        return None
+    try:
+        return int(after)
+    except ValueError:
+        raise Http404
+
+def _spark_new(link, after, limit=None):
+    """Return (rx, tx, seq): rate lists of the link's reports after the 
+    sequence number after (at most limit) and the newest sequence number.
+    """
+    seq = rate_snapshot.get().seqs.get(int(link))
+    return sparkline_cache.rates_after(link, after, limit or SPARKLINE_LIMIT, 
+        seq)
+
+def _spark_series(link, seconds=None, limit=None):
+    """Return (rx, tx) rate lists for sparklines.
+    
+    Long ranges are read from rollups, others from the sparkline cache.
+    """
+    if seconds is not None:
+        start = datetime.now() - timedelta(seconds=seconds)
+        series = BandwidthRollup.objects.series(link, start, 
+            points=limit or SPARKLINE_LIMIT)
+        if series is not None:
+            if limit:
+                return (series[0][-limit:], series[1][-limit:])
+            return series
+    seq = rate_snapshot.get().seqs.get(int(link))
+    return sparkline_cache.rates(link, seconds, limit, seq)
+
+def _spark_etag(request, link):
+    """Return the sequence number of the link's newest report (and the 
+    update interval for time ranges, which move with time)."""
+    snapshot = rate_snapshot.get()
+    etag = 'spark-{0}'.format(snapshot.seqs.get(int(link), 0))
+    if request.GET.get('seconds'):
+        etag += '-{0}'.format(snapshot.bucket)
+    return etag
+
+def _spark_json(fields, *series):
+    """Return a DataTable JSON string with a column of rates per field."""
+    description = dict([(f, ('number', 'Bandwidth')) for f in fields])
+    data_table = gviz_api.DataTable(description, columnar=True)
+    data_table.AppendColumns(dict([(f, 
+            [round(v/BW_DIVISOR, BW_DECIMAL_POINTS) for v in values])
+        for f, values in zip(fields, series)]))
     return data_table.ToJSon()
 
+def _spark_map(func, items):
+    """Map func over items, in a thread pool if there are many items."""
+    items = list(items)
+    if len(items) <= SPARKLINE_POOL_THRESHOLD or SPARKLINE_POOL_SIZE < 2:
+        return map(func, items)
+    with _spark_pool_lock:
+        if not _spark_pool:
+            _spark_pool.append(ThreadPool(SPARKLINE_POOL_SIZE))
+    return _spark_pool[0].map(func, items)
+
+def _spark_many_etag(request, link):
+    """Return the sequence number of the newest report and the update 
+    interval (the time range moves with time)."""
+    snapshot = rate_snapshot.get()
+    return 'sparks-{0}-{1}'.format(max([0] + snapshot.seqs.values()), 
+        snapshot.bucket)
+
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_spark_many_etag)
+def xhr_spark_many(request, link):
+    """Return JSON data with a table of rx and tx rates for each link.
+
+    The rates of the last ?seconds=<n> (SPARKLINE_SECONDS by default) are
+    read with one query, and at most ?limit=<n> (SPARKLINE_LIMIT by default)
+    are returned per link, downsampled to ?points=<n> (SPARKLINE_POINTS by
+    default). With ?after=<seq>, only the rates of reports after seq are 
+    returned (not downsampled), as {"seq": <newest seq>, "links": {...}}.
+    """
+    seconds, limit = _spark_range(request)
+    seconds = seconds or SPARKLINE_SECONDS
+    limit = limit or SPARKLINE_LIMIT
+    after = _spark_after(request)
+    links = None
+    if link != 'all':
+        links = sorted(set(_links(link)))
+    if after is not None:
+        if links is None:
+            links = sorted(rate_snapshot.get().seqs)
+        seq, tables = after, []
+        for l in links:
+            rx, tx, newest = _spark_new(l, after, limit)
+            seq = max(seq, newest)
+            tables.append('"{0}":{1}'.format(l, _spark_json(('rx', 'tx'), 
+                rx, tx)))
+        return HttpResponse('{{"seq":{0},"links":{{{1}}}}}'.format(seq, 
+            ','.join(tables)), 'application/json')
+    series = Bandwidth.objects.window_rates_many(links, seconds=seconds, 
+        limit=limit, map=_spark_map)
+    if links is None:
+        links = sorted(series)
+    points = _spark_points(request)
+    tables = ['"{0}":{1}'.format(l, _spark_json(('rx', 'tx'), 
+            *_spark_downsample(series.get(l, ([], [])), points)))
+        for l in links]
+    return HttpResponse('{' + ','.join(tables) + '}', 'application/json')
+
 class MapView(TemplateView):
     template_name='gmap/map.html'
 
     def render_to_response(self, context):
         context = RequestContext(self.request, {
             'api_key': MAP_API_KEY,
-            'bw_url': reverse('xhr_bw', args=(0, )).split('0')[0],
-            'spark_rx_url': reverse('xhr_spark_rx', args=(0, )).split('0')[0],
-            'spark_tx_url': reverse('xhr_spark_tx', args=(0, )).split('0')[0],
+            'map_url': reverse('xhr_map'),
+            'bw_url': reverse('xhr_bw', args=('all', )),
+            'bw_stream_url': reverse('xhr_bw_stream'),
+            'spark_image_url': reverse('sparkline_image', kwargs={
+                'direction': 'rx', 'link': 0, 'format': 'svg'}).split('rx')[0],
             'bw_update_interval': BW_UPDATE_INTERVAL*1000, # ms
             'bw_divisor': BW_DIVISOR,
         })
@@ -73,25 +499,176 @@ class SparkLine(TemplateView):
 
     def render_to_response(self, context):
         link = self.kwargs['link']
+        query = self.request.GET.urlencode()
+        urls = [reverse('sparkline_image', kwargs={'direction': direction, 
+                'link': link, 'format': 'svg'}) + (query and '?' + query)
+            for direction in ('rx', 'tx')]
         context = RequestContext(self.request, {
-            'rx_data': _spark_json(link, 'rx'),
-            'tx_data': _spark_json(link, 'tx'),
+            'rx_url': urls[0],
+            'tx_url': urls[1],
         })
         return super(SparkLine, self).render_to_response(context)
 
+sparkline = cache_control(max_age=BW_MAX_AGE)(
+    condition(etag_func=_spark_etag)(SparkLine.as_view()))
+
+def _spark_image_etag(request, link, direction, format):
+    return _spark_etag(request, link)
+
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_spark_image_etag)
+def sparkline_image(request, link, direction, format):
+    """Return an SVG (or PNG, if PIL is installed) sparkline of a link's rx
+    or tx rates (see xhr_spark_rx for the range parameters).
+    
+    Images are rendered once per link, direction, range and newest report 
+    (as of the rate snapshot), or update interval for time ranges, and kept
+    in the Django cache. Processes share the renders only if the cache 
+    backend is shared (e.g. memcached); with the default locmem backend each
+    process renders its own. Ranges are bounded (limit and points by 
+    SPARKLINE_LIMIT, seconds by SPARKLINE_MAX_SECONDS and rounded up to 
+    minutes) so requests cannot create unbounded cache keys.
+    """
+    if format == 'png' and not charts.PNG:
+        raise Http404
+    seconds, limit = _spark_range(request)
+    if seconds is not None:
+        seconds = min(-(-seconds // 60) * 60, SPARKLINE_MAX_SECONDS)
+    if limit is not None:
+        limit = min(limit, SPARKLINE_LIMIT)
+    points = min(_spark_points(request), SPARKLINE_LIMIT)
+    key = 'gmap.sparkline.{0}.{1}.{2}.{3}.{4}.{5}.{6}'.format(link, 
+        direction, format, seconds, limit, points, 
+        _spark_etag(request, link))
+    image = cache.get(key)
+    if image is None:
+        rates = _spark_series(link, seconds, limit)[direction == 'tx']
+        rates = lttb([v/BW_DIVISOR for v in rates], points)
+        render = charts.svg if format == 'svg' else charts.png
+        image = render(rates)
+        cache.set(key, image, SPARKLINE_IMAGE_TIMEOUT)
+    return HttpResponse(image, SPARKLINE_IMAGE_TYPES[format])
+
 
 ###
 ### Debug views
 ###
+def _spark_response(request, link, direction):
+    """Return a response with a table of the link's rx or tx rates.
+
+    The rates are downsampled to ?points=<n> (SPARKLINE_POINTS by default).
+    With ?after=<seq>, only the rates of reports after seq are returned (not
+    downsampled), as {"seq": <newest seq>, "table": ...}.
+    """
+    seconds, limit = _spark_range(request)
+    after = _spark_after(request)
+    if after is None:
+        rates = _spark_series(link, seconds, limit)[direction == 'tx']
+        rates = lttb(rates, _spark_points(request))
+    else:
+        series = _spark_new(link, after, limit)
+        rates = series[direction == 'tx']
+    data = _spark_json((direction, ), rates)
+    if after is not None:
+        data = '{{"seq":{0},"table":{1}}}'.format(series[2], data)
+    return HttpResponse(data, 'application/json')
+
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_spark_etag)
 def xhr_spark_rx(request, link):
     """Return rx traffic in bits as JSON data"""
     # http://ndnmap.arl.wustl.edu/xhr_sparkline/rx/1
-    return HttpResponse(_spark_json(link, 'rx'), 'application/json')
+    return _spark_response(request, link, 'rx')
 
+@cache_control(max_age=BW_MAX_AGE)
+@condition(etag_func=_spark_etag)
 def xhr_spark_tx(request, link):
-    """Return rx traffic in bits as JSON data"""
+    """Return tx traffic in bits as JSON data"""
     # http://ndnmap.arl.wustl.edu/xhr_sparkline/tx/1
-    return HttpResponse(_spark_json(link, 'tx'), 'application/json')
+    return _spark_response(request, link, 'tx')
+
+def _tqx(tqx):
+    """Return a dictionary of the options of a gviz tqx parameter.
+
+    Raises ValueError for options DataTable.ToResponse does not accept.
+    """
+    options = {}
+    for opt in tqx.split(';'):
+        if opt:
+            name, value = opt.split(':') # ValueError unless one ':'
+            options[name] = value
+    if options.get('version', '0.6') != '0.6':
+        raise ValueError('unsupported version')
+    return options
+
+def datasource(request):
+    """Answer Google Visualization queries (?tq=) over all reports.
+
+    See gmap.datasource for the supported queries.
+    """
+    import json
+    tqx = request.GET.get('tqx', '')
+    try:
+        options = _tqx(tqx)
+        out = options.get('out', 'json')
+        if out not in GVIZ_MIMETYPES:
+            raise ValueError
+    except ValueError:
+        return HttpResponseBadRequest('Invalid tqx.\n')
+    try:
+        table = Query(request.GET.get('tq', '')).table()
+    except QueryError as e:
+        if out != 'json':
+            return HttpResponseBadRequest('Invalid query: {0}.\n'.format(e))
+        handler = options.get('responseHandler', 
+            'google.visualization.Query.setResponse')
+        error = {'version': '0.6', 'reqId': options.get('reqId', '0'), 
+            'status': 'error', 'errors': [{'reason': 'invalid_query', 
+            'message': str(e)}]}
+        return HttpResponse('{0}({1});'.format(handler, json.dumps(error)),
+            GVIZ_MIMETYPES[out])
+    try:
+        response = table.ToResponse(tqx=tqx)
+    except (gviz_api.DataTableException, ValueError):
+        return HttpResponseBadRequest('Invalid tqx.\n')
+    return HttpResponse(response, GVIZ_MIMETYPES[out])
+
+def _history_pages(link, page_size):
+    """Yield lists of (update_date, time, rx, tx) reports of a link, oldest 
+    first, reading page_size reports per query (by primary key range)."""
+    last = 0
+    while True:
+        page = list(Bandwidth.objects.filter(link=link, id__gt=last)
+            .order_by('id')
+            .values_list('id', 'update_date', 'time', 'rx', 'tx')[:page_size])
+        if not page:
+            return
+        last = page[-1][0]
+        yield [row[1:] for row in page]
+
+def history(request, link):
+    """Stream all reports of a link as a gviz data source response.
+
+    ?tqx=out:csv (or html, tsv-excel) selects the format, as for ToResponse.
+    """
+    tqx = request.GET.get('tqx', '')
+    table = gviz_api.DataTable(HISTORY_DESCRIPTION, columnar=True)
+    try:
+        chunks = table.IterResponse(tqx=tqx, 
+            pages=_history_pages(int(link), HISTORY_PAGE_SIZE))
+    except (gviz_api.DataTableException, ValueError):
+        return HttpResponseBadRequest('Invalid tqx.\n')
+    out = _tqx(tqx).get('out', 'json')
+    response = HttpResponse(chunks, GVIZ_MIMETYPES[out])
+    if out != 'json':
+        response['Content-Disposition'] = 'attachment; filename=link{0}.{1}'\
+            .format(link, out == 'tsv-excel' and 'tsv' or out)
+    return response
+
+def xhr_ingest_stats(request):
+    """Return write-behind buffer counters as JSON data"""
+    import json
+    return HttpResponse(json.dumps(write_behind.stats()), 'application/json')
 
 class DebugView(TemplateView):
     # http://ndnmap.arl.wustl.edu/debug